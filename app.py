@@ -1,7 +1,8 @@
 import os
 import logging
 import urllib.parse
-from flask import Flask, send_from_directory, render_template, session
+from flask import Flask, send_from_directory, render_template, session, make_response
+from jinja2.utils import htmlsafe_json_dumps
 from flask_cors import CORS
 
 # Imports dos blueprints
@@ -11,6 +12,8 @@ from routes.data import data_bp
 from routes.archive import archive_bp
 from routes.resumo import resumo_bp  # dashboard
 from routes.tv import tv_bp
+from routes.stream import stream_bp
+from routes.export import export_bp
 
 
 def create_app():
@@ -49,6 +52,15 @@ def create_app():
 
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+    # Streams SSE (/api/stream) abertos ao mesmo tempo por worker. Cada um ocupa uma
+    # thread do gthread; o restante das --threads fica para /api/cell, /api/data etc.
+    app.config["SSE_MAX_STREAMS"] = int(os.getenv("SSE_MAX_STREAMS", 16))
+
+    # Write-behind: agrupa os salvamentos de /api/cell em commits únicos por worker
+    app.config["CELL_WRITE_BEHIND"] = os.getenv("CELL_WRITE_BEHIND", "False").lower() == "true"
+    app.config["CELL_WRITE_BEHIND_MAX_BATCH"] = int(os.getenv("CELL_WRITE_BEHIND_MAX_BATCH", 100))
+    app.config["CELL_WRITE_BEHIND_MAX_DELAY_MS"] = int(os.getenv("CELL_WRITE_BEHIND_MAX_DELAY_MS", 5))
+
     logging.basicConfig()
     logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO)
 
@@ -81,13 +93,175 @@ def create_app():
                 db.session.rollback()
                 print(f"⚠️ Erro ao adicionar coluna '{column}' em '{table}': {e}")
 
+        def create_index_if_not_exists(name, table, columns, unique=False):
+            try:
+                # CREATE INDEX IF NOT EXISTS é suportado por SQLite e PostgreSQL
+                kind = "UNIQUE INDEX" if unique else "INDEX"
+                db.session.execute(text(f'CREATE {kind} IF NOT EXISTS {name} ON "{table}" ({columns});'))
+                db.session.commit()
+                print(f"✅ Índice '{name}' verificado na tabela '{table}'.")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Erro ao criar índice '{name}' em '{table}': {e}")
+
         # Migrações necessárias
+        from sqlalchemy import inspect
+        # daily_sales ainda no formato largo (antes da migração para daily_sales_fact)?
+        daily_sales_largo = 'daily_sales' in inspect(db.engine).get_table_names()
+
         add_column_if_not_exists('user', 'password', "VARCHAR(128) NOT NULL DEFAULT ''")
         add_column_if_not_exists('sales', 'sheet_type', "VARCHAR(20) DEFAULT 'portabilidade'")
-        add_column_if_not_exists('daily_sales', 'sheet_type', "VARCHAR(20) DEFAULT 'portabilidade'")
+        if daily_sales_largo:
+            add_column_if_not_exists('daily_sales', 'sheet_type', "VARCHAR(20) DEFAULT 'portabilidade'")
+        add_column_if_not_exists('data_version', 'resync_version', "BIGINT NOT NULL DEFAULT 0")
+
+        # Índice único usado pelo upsert em lote (ON CONFLICT) das vendas
+        create_index_if_not_exists('uq_employee_day_sheet', 'sales', 'employee_name, day, sheet_type', unique=True)
+
+        # Chave inteira do vendedor (user_id) + índices dos caminhos de acesso reais
+        add_column_if_not_exists('sales', 'user_id', 'INTEGER REFERENCES "user"(id) ON DELETE CASCADE')
+        create_index_if_not_exists('ix_sales_sheet_user_day', 'sales', 'sheet_type, user_id, day')
+        if daily_sales_largo:
+            add_column_if_not_exists('daily_sales', 'user_id', 'INTEGER REFERENCES "user"(id) ON DELETE SET NULL')
+            create_index_if_not_exists('ix_daily_sales_dia_sheet_user', 'daily_sales', 'dia, sheet_type, user_id')
+        try:
+            # Backfill em lote: um UPDATE por tabela, só nas linhas ainda sem user_id
+            db.session.execute(text("""
+                UPDATE sales SET user_id = (SELECT u.id FROM "user" u WHERE u.username = sales.employee_name)
+                WHERE user_id IS NULL;
+            """))
+            if daily_sales_largo:
+                db.session.execute(text("""
+                    UPDATE daily_sales SET user_id = (SELECT u.id FROM "user" u WHERE u.username = daily_sales.vendedor)
+                    WHERE user_id IS NULL;
+                """))
+            db.session.commit()
+            print("✅ user_id preenchido em 'sales' e 'daily_sales'.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Erro ao preencher user_id: {e}")
+
+        if daily_sales_largo:
+            try:
+                # Remove snapshots diários duplicados (fica o mais recente) antes do índice único
+                result = db.session.execute(text("""
+                    DELETE FROM daily_sales WHERE id NOT IN (
+                        SELECT MAX(id) FROM daily_sales GROUP BY vendedor, dia, sheet_type
+                    );
+                """))
+                db.session.commit()
+                if result.rowcount:
+                    print(f"✅ {result.rowcount} snapshot(s) duplicado(s) removido(s) de 'daily_sales'.")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Erro ao deduplicar 'daily_sales': {e}")
+
+            # Formato largo (segunda…sexta + total) -> daily_sales_fact (um valor por linha).
+            # Os ids são mantidos (cursores do histórico continuam válidos) e a tabela
+            # antiga fica guardada como daily_sales_legacy.
+            try:
+                db.session.execute(text("""
+                    INSERT INTO daily_sales_fact (id, vendedor, user_id, dia, sheet_type, value, created_at)
+                    SELECT id, vendedor, user_id, dia, COALESCE(sheet_type, 'portabilidade'), COALESCE(total, 0), created_at
+                    FROM daily_sales;
+                """))
+                if db.engine.dialect.name == 'postgresql':
+                    db.session.execute(text("""
+                        SELECT setval(pg_get_serial_sequence('daily_sales_fact', 'id'),
+                                      COALESCE((SELECT MAX(id) FROM daily_sales_fact), 0) + 1, false);
+                    """))
+                db.session.execute(text("ALTER TABLE daily_sales RENAME TO daily_sales_legacy;"))
+                db.session.commit()
+                print("✅ 'daily_sales' migrada para 'daily_sales_fact' (original em 'daily_sales_legacy').")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Erro ao migrar 'daily_sales' para 'daily_sales_fact': {e}")
+
+        try:
+            # created_at obrigatório: a paginação do histórico (created_at, id) usa o índice
+            # sem tratar nulos. Linhas antigas sem data recebem a do próprio dia.
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute(text("UPDATE daily_sales_fact SET created_at = CAST(dia AS TIMESTAMP) WHERE created_at IS NULL;"))
+                db.session.execute(text("ALTER TABLE daily_sales_fact ALTER COLUMN created_at SET NOT NULL;"))
+            else:
+                # SQLite não altera a restrição da coluna; bancos novos já nascem com NOT NULL
+                db.session.execute(text("UPDATE daily_sales_fact SET created_at = datetime(dia) WHERE created_at IS NULL;"))
+            db.session.commit()
+            print("✅ 'daily_sales_fact.created_at' preenchido.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Erro ao preencher 'daily_sales_fact.created_at': {e}")
+
+        if 'daily_sales' not in inspect(db.engine).get_table_names():
+            try:
+                # View de compatibilidade no formato antigo (to_dict / histórico diário)
+                if db.engine.dialect.name == 'postgresql':
+                    dia_semana, criar = "EXTRACT(ISODOW FROM dia)", "CREATE OR REPLACE VIEW"
+                else:
+                    dia_semana, criar = "CAST(strftime('%w', dia) AS INTEGER)", "CREATE VIEW IF NOT EXISTS"
+                colunas_dias = ",\n".join(
+                    f"CASE WHEN {dia_semana} = {i} THEN value ELSE 0.0 END AS {nome}"
+                    for i, nome in enumerate(["segunda", "terca", "quarta", "quinta", "sexta"], start=1)
+                )
+                db.session.execute(text(f"""
+                    {criar} daily_sales AS
+                    SELECT id, vendedor, user_id, dia, sheet_type,
+                    {colunas_dias},
+                    value AS total, created_at
+                    FROM daily_sales_fact;
+                """))
+                db.session.commit()
+                print("✅ View 'daily_sales' verificada.")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Erro ao criar a view 'daily_sales': {e}")
+
+        # Fechamento semanal idempotente: um resumo por semana e planilha
+        add_column_if_not_exists('resumo_history', 'sheet_type', "VARCHAR(20) DEFAULT 'portabilidade'")
+        try:
+            # Fechamentos repetidos da mesma semana: fica o de maior total (os seguintes
+            # foram gravados depois da planilha zerada)
+            result = db.session.execute(text("""
+                DELETE FROM resumo_history WHERE EXISTS (
+                    SELECT 1 FROM resumo_history o
+                    WHERE o.started_at = resumo_history.started_at
+                      AND o.sheet_type = resumo_history.sheet_type
+                      AND (o.total > resumo_history.total
+                           OR (o.total = resumo_history.total AND o.id < resumo_history.id))
+                );
+            """))
+            db.session.commit()
+            if result.rowcount:
+                print(f"✅ {result.rowcount} fechamento(s) duplicado(s) removido(s) de 'resumo_history'.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Erro ao deduplicar 'resumo_history': {e}")
+        create_index_if_not_exists('uq_resumo_history_week_sheet', 'resumo_history', 'started_at, sheet_type', unique=True)
         
+        try:
+            # Primeira subida com sales_rollup: gera os totais a partir do histórico existente
+            from models.archive import DailySalesFact, SalesRollup
+            from rollup import rebuild_rollups
+            if SalesRollup.query.first() is None and DailySalesFact.query.first() is not None:
+                stats = rebuild_rollups()
+                print(f"✅ 'sales_rollup' gerada: {stats['rows']} linhas em {stats['elapsed_ms']} ms.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Erro ao gerar 'sales_rollup': {e}")
+
         print("✅ Tabelas do banco verificadas/criadas com sucesso.")
 
+    # ---------------------------
+    # Comandos de manutenção: python -m flask --app app:create_app rebuild-rollups
+    # (rodar na pasta do app; o "flask" solto importa o pacote pai por causa do __init__.py)
+    # ---------------------------
+    @app.cli.command("rebuild-rollups")
+    def rebuild_rollups_command():
+        """Regenera os totais por dia/semana/mês (sales_rollup) a partir do histórico."""
+        from rollup import rebuild_rollups
+        stats = rebuild_rollups()
+        print(f"✅ 'sales_rollup' regenerada: {stats['rows']} linhas em {stats['elapsed_ms']} ms.")
+
     # ---------------------------
     # CORS
     # ---------------------------
@@ -98,9 +272,11 @@ def create_app():
     # ---------------------------
     app.register_blueprint(user_bp, url_prefix="/api")
     app.register_blueprint(data_bp, url_prefix="/api")
+    app.register_blueprint(stream_bp, url_prefix="/api")
     app.register_blueprint(archive_bp, url_prefix="/archive")
     app.register_blueprint(resumo_bp)
     app.register_blueprint(tv_bp)
+    app.register_blueprint(export_bp)
 
     # ---------------------------
     # Filtro Jinja moeda brasileira
@@ -119,84 +295,6 @@ def create_app():
     def db_check():
         return f"Banco em uso: {app.config['SQLALCHEMY_DATABASE_URI']}"
 
-    # ---------------------------
-    # Rota pública /tv (PORTABILIDADE)
-    # ---------------------------
-    @app.route("/tv")
-    def tv():
-        try:
-            from models.sales import Sale
-            from models.user import User
-            employees = User.query.filter_by(role='user').order_by(User.order.asc(), User.id.asc()).all()
-            dados = []
-            for emp in employees:
-                nome = emp.username
-                sales = Sale.query.filter_by(employee_name=nome, sheet_type='portabilidade').all()
-                day_values = {s.day: s.value for s in sales}
-                linha = {
-                    "nome": nome,
-                    "seg": day_values.get("monday", 0),
-                    "ter": day_values.get("tuesday", 0),
-                    "qua": day_values.get("wednesday", 0),
-                    "qui": day_values.get("thursday", 0),
-                    "sex": day_values.get("friday", 0),
-                    "total": sum(day_values.get(d, 0) for d in ["monday", "tuesday", "wednesday", "thursday", "friday"])
-                }
-                dados.append(linha)
-
-            totais_diarios = {
-                "seg": sum(l["seg"] for l in dados),
-                "ter": sum(l["ter"] for l in dados),
-                "qua": sum(l["qua"] for l in dados),
-                "qui": sum(l["qui"] for l in dados),
-                "sex": sum(l["sex"] for l in dados),
-            }
-
-            return render_template("tv.html", dados=dados, totais_diarios=totais_diarios)
-        except Exception as e:
-            print(f"Erro ao carregar dados para /tv: {e}")
-            return f"Erro Interno do Servidor: {e}", 500
-
-    # ---------------------------
-    # Rota pública /tv/novo (NOVO)
-    # ---------------------------
-    @app.route("/tv/novo")
-    def tv_novo():
-        try:
-            from models.sales import Sale
-            from models.user import User
-            employees = User.query.filter_by(role='user').order_by(User.order.asc(), User.id.asc()).all()
-            dados = []
-            for emp in employees:
-                nome = emp.username
-                sales = Sale.query.filter_by(employee_name=nome, sheet_type='novo').all()
-                day_values = {s.day: s.value for s in sales}
-                linha = {
-                    "nome": nome,
-                    "seg": day_values.get("monday", 0),
-                    "ter": day_values.get("tuesday", 0),
-                    "qua": day_values.get("wednesday", 0),
-                    "qui": day_values.get("thursday", 0),
-                    "sex": day_values.get("friday", 0),
-                    "total": sum(day_values.get(d, 0) for d in ["monday", "tuesday", "wednesday", "thursday", "friday"])
-                }
-                dados.append(linha)
-
-            totais_diarios = {
-                "seg": sum(l["seg"] for l in dados),
-                "ter": sum(l["ter"] for l in dados),
-                "qua": sum(l["qua"] for l in dados),
-                "qui": sum(l["qui"] for l in dados),
-                "sex": sum(l["sex"] for l in dados),
-            }
-
-            return render_template("tv_novo.html", dados=dados, totais_diarios=totais_diarios)
-        except Exception as e:
-            print(f"Erro ao carregar dados para /tv/novo: {e}")
-            return f"Erro Interno do Servidor: {e}", 500
-
-
-
     # ---------------------------
     # Rota pública /meta-feriado (META FERIADO 21/11)
     # ---------------------------
@@ -214,21 +312,29 @@ def create_app():
             sellers_data = {}
             team_total = 0
             
-            from models.archive import DailySales
+            from models.archive import DailySalesFact
+            from sqlalchemy import func
             hoje = date.today()
             ano = hoje.year
             mes = hoje.month
             start_date = date(ano, mes, 3)
             end_date = date(ano, mes, 20)
+            vendedores = ['Jemima', 'Maiany', 'Nadia']
+
+            # Total consolidado (dias anteriores) dos vendedores numa única consulta
+            consolidados = dict(
+                db.session.query(DailySalesFact.vendedor, func.sum(DailySalesFact.value))
+                .filter(
+                    DailySalesFact.vendedor.in_(vendedores),
+                    DailySalesFact.dia >= start_date,
+                    DailySalesFact.dia < hoje
+                )
+                .group_by(DailySalesFact.vendedor)
+                .all()
+            )
             
-            for seller_name in ['Jemima', 'Maiany', 'Nadia']:
-                daily_sales = DailySales.query.filter(
-                    DailySales.vendedor == seller_name,
-                    DailySales.dia >= start_date,
-                    DailySales.dia < hoje
-                ).all()
-                
-                total_consolidado = sum(ds.total for ds in daily_sales)
+            for seller_name in vendedores:
+                total_consolidado = consolidados.get(seller_name) or 0.0
                 
                 today_weekday = hoje.strftime('%A').lower()
                 
@@ -283,37 +389,13 @@ def create_app():
     @app.route("/export_table")
     def export_table():
         try:
-            from models.sales import Sale
-            from models.user import User
-            from models.archive import DailySales
+            from leaderboard import build_leaderboard, build_history_leaderboard
             from flask import request
             from datetime import datetime, timedelta
 
             # Parâmetro de semana (formato YYYY-MM-DD da segunda-feira)
             week_start_str = request.args.get('week')
             
-            employees = User.query.filter_by(role='user').order_by(User.order.asc(), User.id.asc()).all()
-            
-            # Buscar todas as semanas disponíveis no histórico
-            available_weeks = []
-            try:
-                available_weeks_raw = db.session.query(DailySales.dia).distinct().order_by(DailySales.dia.desc()).all()
-                seen_weeks = set()
-                
-                for d in available_weeks_raw:
-                    # Encontrar a segunda-feira daquela semana
-                    monday = d[0] - timedelta(days=d[0].weekday())
-                    if monday not in seen_weeks:
-                        friday = monday + timedelta(days=4)
-                        available_weeks.append({
-                            "start": monday.isoformat(),
-                            "label": f"{monday.strftime('%d/%m/%Y')} a {friday.strftime('%d/%m/%Y')}"
-                        })
-                        seen_weeks.add(monday)
-            except Exception as e:
-                db.session.rollback()
-                print(f"Erro ao carregar semanas disponíveis: {e}")
-
             is_history = False
             selected_week_label = "Semana Atual"
 
@@ -321,77 +403,23 @@ def create_app():
                 try:
                     week_start = datetime.strptime(week_start_str, '%Y-%m-%d').date()
                     week_end = week_start + timedelta(days=4)
+                    # Carregar dados do histórico (daily_sales_fact) das duas planilhas numa consulta
+                    board = build_history_leaderboard(week_start, week_end)
                     is_history = True
                     selected_week_label = f"{week_start.strftime('%d/%m/%Y')} a {week_end.strftime('%d/%m/%Y')}"
-                    
-                    # Carregar dados do histórico (DailySales)
-                    def get_history_data(s_type):
-                        history_dados = []
-                        for emp in employees:
-                            # Buscar registros da semana para este vendedor e tipo
-                            records = DailySales.query.filter(
-                                DailySales.vendedor == emp.username,
-                                DailySales.sheet_type == s_type,
-                                DailySales.dia >= week_start,
-                                DailySales.dia <= week_end
-                            ).all()
-                            
-                            # Consolidar valores da semana (pode haver múltiplos registros por dia se salvou várias vezes, 
-                            # mas a lógica do daily_save agora atualiza)
-                            linha = {"nome": emp.username, "seg": 0, "ter": 0, "qua": 0, "qui": 0, "sex": 0, "total": 0}
-                            for r in records:
-                                linha["seg"] = max(linha["seg"], r.segunda)
-                                linha["ter"] = max(linha["ter"], r.terca)
-                                linha["qua"] = max(linha["qua"], r.quarta)
-                                linha["qui"] = max(linha["qui"], r.quinta)
-                                linha["sex"] = max(linha["sex"], r.sexta)
-                            
-                            linha["total"] = linha["seg"] + linha["ter"] + linha["qua"] + linha["qui"] + linha["sex"]
-                            history_dados.append(linha)
-                        return history_dados
-
-                    dados_port = get_history_data('portabilidade')
-                    dados_novo = get_history_data('novo')
                 except Exception as e:
+                    db.session.rollback()
                     print(f"Erro ao processar data histórica: {e}")
                     week_start_str = None # Fallback para atual
 
             if not week_start_str:
-                # Lógica original para semana atual (dados em tempo real)
-                dados_port = []
-                for emp in employees:
-                    nome = emp.username
-                    sales = Sale.query.filter_by(employee_name=nome, sheet_type='portabilidade').all()
-                    day_values = {s.day: s.value for s in sales}
-                    linha = {
-                        "nome": nome,
-                        "seg": day_values.get("monday", 0),
-                        "ter": day_values.get("tuesday", 0),
-                        "qua": day_values.get("wednesday", 0),
-                        "qui": day_values.get("thursday", 0),
-                        "sex": day_values.get("friday", 0),
-                        "total": sum(day_values.get(d, 0) for d in ["monday", "tuesday", "wednesday", "thursday", "friday"])
-                    }
-                    dados_port.append(linha)
-
-                dados_novo = []
-                for emp in employees:
-                    nome = emp.username
-                    sales = Sale.query.filter_by(employee_name=nome, sheet_type='novo').all()
-                    day_values = {s.day: s.value for s in sales}
-                    linha = {
-                        "nome": nome,
-                        "seg": day_values.get("monday", 0),
-                        "ter": day_values.get("tuesday", 0),
-                        "qua": day_values.get("wednesday", 0),
-                        "qui": day_values.get("thursday", 0),
-                        "sex": day_values.get("friday", 0),
-                        "total": sum(day_values.get(d, 0) for d in ["monday", "tuesday", "wednesday", "thursday", "friday"])
-                    }
-                    dados_novo.append(linha)
-
-            totais_port = {d: sum(l[d] for l in dados_port) for d in ["seg", "ter", "qua", "qui", "sex"]}
-            totais_novo = {d: sum(l[d] for l in dados_novo) for d in ["seg", "ter", "qua", "qui", "sex"]}
+                # Semana atual (dados em tempo real)
+                board = build_leaderboard()
+
+            dados_port = board['portabilidade']['dados']
+            totais_port = board['portabilidade']['totais_diarios']
+            dados_novo = board['novo']['dados']
+            totais_novo = board['novo']['totais_diarios']
 
             return render_template(
                 "tabela_para_extracao.html",
@@ -399,7 +427,6 @@ def create_app():
                 totais_port=totais_port,
                 dados_novo=dados_novo,
                 totais_novo=totais_novo,
-                available_weeks=available_weeks,
                 current_week=week_start_str,
                 is_history=is_history,
                 selected_week_label=selected_week_label
@@ -443,6 +470,34 @@ def create_app():
     # ---------------------------
     # Rotas estáticas / SPA
     # ---------------------------
+    shell_cache = {}
+    SCRIPT_TAG = '<script src="/static/script.js"></script>'
+
+    def serve_spa_shell(static_folder_path):
+        """index.html com os dados iniciais embutidos (planilhas, vendedores, sessão e versões)."""
+        from routes.data import get_bootstrap_json
+
+        index_path = os.path.join(static_folder_path, "index.html")
+        mtime = os.path.getmtime(index_path)
+        if shell_cache.get("mtime") != mtime:
+            with open(index_path, encoding="utf-8") as f:
+                shell_cache.update(mtime=mtime, html=f.read())
+
+        session_state = htmlsafe_json_dumps({
+            "logged_in": 'user' in session,
+            "user": session.get('user'),
+            "is_admin": session.get('is_admin', False)
+        })
+        bootstrap = (
+            '<script id="bootstrap-data" type="application/json">'
+            f'{{"session": {session_state}, "data": {get_bootstrap_json()}}}'
+            '</script>\n    '
+        )
+        html = shell_cache["html"].replace(SCRIPT_TAG, bootstrap + SCRIPT_TAG, 1)
+        response = make_response(html)
+        response.headers["Cache-Control"] = "no-store"  # contém sessão e dados ao vivo
+        return response
+
     @app.route("/", defaults={"path": ""})
     @app.route("/<path:path>")
     def serve(path):
@@ -453,6 +508,11 @@ def create_app():
         if path and os.path.exists(full_path):
             return send_from_directory(static_folder_path, path)
         else:
-            return send_from_directory(static_folder_path, "index.html")
+            try:
+                return serve_spa_shell(static_folder_path)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Erro ao embutir dados iniciais: {e}")
+                return send_from_directory(static_folder_path, "index.html")
 
     return app
\ No newline at end of file
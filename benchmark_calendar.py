@@ -0,0 +1,140 @@
+"""
+Benchmark do calendar_engine contra os laços em Python que o dashboard usava
+(mês a mês, dia a dia sobre os rollups diários), incluindo o tempo de leitura.
+
+Uso: python benchmark_calendar.py [--anos 3] [--vendedores 30] [--repeticoes 5]
+Cria um banco SQLite temporário com dados sintéticos; não toca no banco do app.
+"""
+import argparse
+import os
+import tempfile
+import time
+from calendar import monthrange
+from datetime import date, timedelta
+
+from flask import Flask
+from sqlalchemy import insert
+
+from models.user import db
+from models.archive import DailySalesFact
+from rollup import get_rollup_totals, rebuild_rollups
+from calendar_engine import EPOCH, GRANULARITIES, CalendarFrame, synthetic_frame, _cached_frame
+
+
+# --- Versões anteriores (laços por mês sobre os rollups diários) ---
+
+def legado_dias(ano, mes):
+    primeiro_dia = date(ano, mes, 1)
+    ultimo_dia = date(ano, mes, monthrange(ano, mes)[1])
+    daily_totals_map = get_rollup_totals('day', primeiro_dia, ultimo_dia)
+    daily_totals = [0.0] * 5
+    for dia, total_dia in daily_totals_map.items():
+        if 0 <= dia.weekday() <= 4:
+            daily_totals[dia.weekday()] += total_dia
+    return daily_totals
+
+
+def legado_semanas(ano, mes):
+    primeiro_dia = date(ano, mes, 1)
+    ultimo_dia = date(ano, mes, monthrange(ano, mes)[1])
+    daily_totals_map = get_rollup_totals('day', primeiro_dia, ultimo_dia)
+    dias_no_mes = ultimo_dia.day
+    num_semanas = -(-(dias_no_mes + primeiro_dia.weekday()) // 7)
+    totais_mes = [0.0] * num_semanas
+    for dia_do_mes in range(1, dias_no_mes + 1):
+        current_date = date(ano, mes, dia_do_mes)
+        totais_mes[(current_date.day + primeiro_dia.weekday() - 1) // 7] += daily_totals_map.get(current_date, 0.0)
+    return totais_mes
+
+
+def _seed(frame):
+    """Grava o frame sintético em daily_sales_fact e gera os rollups."""
+    days = frame._days.tolist()
+    sheets = [frame.sheet_types[i] for i in frame._sheet_codes.tolist()]
+    sellers = [frame.sellers[i] for i in frame._seller_codes.tolist()]
+    db.session.execute(insert(DailySalesFact.__table__), [
+        {"vendedor": vendedor, "dia": EPOCH + timedelta(days=dia), "sheet_type": sheet, "value": valor}
+        for dia, sheet, vendedor, valor in zip(days, sheets, sellers, frame._values.tolist())
+    ])
+    db.session.commit()
+    rebuild_rollups()
+
+
+def _iguais(a, b):
+    return len(a) == len(b) and all(abs(x - y) < 1e-6 * max(1.0, abs(y)) for x, y in zip(a, b))
+
+
+def medir(funcao, repeticoes, frio=False):
+    """Melhor tempo em ms; frio=True esvazia o cache de frames antes de cada medida."""
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        if frio:
+            _cached_frame.cache_clear()
+        inicio = time.perf_counter()
+        funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--anos', type=int, default=3)
+    parser.add_argument('--vendedores', type=int, default=30)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    from routes.resumo import _daily_totals_for_month, _weekly_totals_for_month
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+    try:
+        with app.app_context():
+            db.create_all()
+            fim = date.today()
+            frame = synthetic_frame(anos=args.anos, vendedores=args.vendedores, fim=fim)
+            _seed(frame)
+            inicio = EPOCH + timedelta(days=int(frame._days.min()))
+            meses = []
+            atual = inicio.replace(day=1)
+            while atual <= fim:
+                meses.append((atual.year, atual.month))
+                atual = (atual + timedelta(days=32)).replace(day=1)
+            print(f"{len(frame)} linhas em daily_sales_fact ({args.anos} anos, {args.vendedores} vendedores, "
+                  f"{len(meses)} meses)")
+
+            # Confere que os dois caminhos dão o mesmo resultado
+            for ano, mes in meses:
+                assert _iguais(_daily_totals_for_month(ano, mes), legado_dias(ano, mes))
+                assert _iguais(_weekly_totals_for_month(ano, mes), legado_semanas(ano, mes))
+
+            print(f"{'totais mês a mês (dias + semanas)':<44}{'ms':>10}")
+            legado_ms = medir(lambda: [(legado_dias(*m), legado_semanas(*m)) for m in meses], args.repeticoes)
+            def engine_meses():
+                return [(_daily_totals_for_month(*m), _weekly_totals_for_month(*m)) for m in meses]
+            frio_ms = medir(engine_meses, args.repeticoes, frio=True)
+            quente_ms = medir(engine_meses, args.repeticoes)
+            print(f"{'  laços anteriores':<44}{legado_ms:>10.2f}")
+            print(f"{'  calendar_engine (lendo cada ano)':<44}{frio_ms:>10.2f}")
+            print(f"{'  calendar_engine (anos já em cache)':<44}{quente_ms:>10.2f}")
+
+            def relatorio(by_seller):
+                frame = CalendarFrame.load(inicio, fim, by_seller=by_seller)
+                return [frame.bucket(granularity, by_seller) for granularity in GRANULARITIES]
+
+            print(f"{'período inteiro, as 4 granularidades':<44}{'ms':>10}")
+            print(f"{'  laços anteriores (só dias/semanas)':<44}{legado_ms:>10.2f}")
+            for by_seller in (False, True):
+                nome = "por vendedor" if by_seller else "equipe"
+                leitura_ms = medir(lambda: CalendarFrame.load(inicio, fim, by_seller=by_seller), args.repeticoes)
+                total_ms = medir(lambda: relatorio(by_seller), args.repeticoes)
+                print(f"{'  calendar_engine, ' + nome + ' (leitura)':<44}{leitura_ms:>10.2f}")
+                print(f"{'  calendar_engine, ' + nome + ' (total)':<44}{total_ms:>10.2f}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# calendar_engine.py
+"""
+Agrupamento do histórico diário por calendário (dia da semana, semana do mês,
+semana ISO e mês) para os totais do dashboard e relatórios de vários meses/anos,
+com ou sem quebra por vendedor.
+
+As colunas (dia, planilha, [vendedor,] valor) são lidas uma vez como tuplas
+simples, com o dia já convertido em inteiro no SQL, e viram arrays do NumPy;
+os buckets saem de np.unique + np.bincount. Sem quebra por vendedor a leitura
+usa os rollups diários (uma linha por dia/planilha) em vez de daily_sales_fact.
+"""
+from datetime import date, timedelta
+from functools import lru_cache
+import numpy as np
+from sqlalchemy import Date, Integer, cast, func, literal, select
+from models.user import db
+from models.archive import DailySalesFact, SalesRollup
+from routes.data import NOMES_DIAS
+
+GRANULARITIES = ('weekday', 'week_of_month', 'iso_week', 'month')
+EPOCH = date(1970, 1, 1)   # foi uma quinta (weekday 3)
+FRAME_CACHE_SIZE = 16
+
+
+def _day_number(column):
+    """Dias desde 1970-01-01 calculados no SQL (PostgreSQL ou SQLite)."""
+    if db.engine.dialect.name == 'postgresql':
+        return cast(column - literal(EPOCH, Date), Integer)
+    # julianday('1970-01-01') = 2440587.5: a diferença é sempre inteira
+    return cast(func.julianday(column) - 2440587.5, Integer)
+
+
+def _label(granularity, key):
+    """Rótulo legível do bucket a partir da chave inteira."""
+    if granularity == 'weekday':
+        return NOMES_DIAS[key]
+    if granularity == 'iso_week':
+        ano, semana, _ = (EPOCH + timedelta(days=key)).isocalendar()
+        return f"{ano}-W{semana:02d}"
+    mes_index = key if granularity == 'month' else key // 8
+    ano, mes = divmod(mes_index, 12)
+    label = f"{ano + 1970}-{mes + 1:02d}"
+    return label if granularity == 'month' else f"{label}#{key % 8 + 1}"
+
+
+def _factorize(nomes):
+    """(nomes distintos em ordem, código de cada linha). Dicionário: bem mais rápido que np.unique em strings."""
+    indices = {}
+    codes = np.fromiter((indices.setdefault(nome, len(indices)) for nome in nomes), dtype=np.int64, count=len(nomes))
+    distintos = sorted(indices)
+    ordem = np.empty(len(indices), dtype=np.int64)
+    ordem[[indices[nome] for nome in distintos]] = np.arange(len(distintos))
+    return distintos, ordem[codes]
+
+
+class CalendarFrame:
+    """Colunas do histórico diário em arrays, prontas para agrupar por calendário."""
+
+    def __init__(self, days, sheet_types, valores, vendedores=None):
+        self.sheet_types, self._sheet_codes = _factorize(sheet_types)
+        self._days = np.asarray(days, dtype=np.int64)
+        self._values = np.asarray(valores, dtype=np.float64)
+        self.sellers, self._seller_codes = [], None
+        if vendedores is not None:
+            self.sellers, self._seller_codes = _factorize(vendedores)
+
+    def __len__(self):
+        return len(self._days)
+
+    @classmethod
+    def load(cls, inicio, fim, sheet_type=None, by_seller=False):
+        """
+        Carrega o intervalo com uma única consulta: daily_sales_fact se precisar
+        de vendedor, senão os rollups diários (bem menos linhas).
+        """
+        if by_seller:
+            dia, colunas = DailySalesFact.dia, [DailySalesFact.sheet_type, DailySalesFact.value, DailySalesFact.vendedor]
+            filtros = [DailySalesFact.sheet_type == sheet_type] if sheet_type is not None else []
+        else:
+            dia, colunas = SalesRollup.period_start, [SalesRollup.sheet_type, SalesRollup.total]
+            filtros = [SalesRollup.period_type == 'day']
+            if sheet_type is not None:
+                filtros.append(SalesRollup.sheet_type == sheet_type)
+        stmt = select(_day_number(dia), *colunas).where(dia >= inicio, dia <= fim, *filtros)
+        # Core direto na conexão: sem o carregamento do ORM, só tuplas
+        rows = db.session.connection().execute(stmt).all()
+        if not rows:
+            return cls([], [], [], [] if by_seller else None)
+        colunas = list(zip(*rows))
+        valores = [valor or 0.0 for valor in colunas[2]]
+        return cls(colunas[0], colunas[1], valores, colunas[3] if by_seller else None)
+
+    @classmethod
+    def load_cached(cls, inicio, fim, sheet_type=None, by_seller=False, version=None):
+        """Como load(), mas reaproveita o frame enquanto a versão do histórico não mudar."""
+        if version is None:
+            from routes.data import get_data_version
+            from rollup import HISTORICO_VERSION_KEY
+            version = get_data_version(HISTORICO_VERSION_KEY)
+        return _cached_frame(inicio, fim, sheet_type, by_seller, version)
+
+    def between(self, inicio, fim):
+        """Frame só com as linhas entre as datas (sem consultar o banco)."""
+        mask = (self._days >= (inicio - EPOCH).days) & (self._days <= (fim - EPOCH).days)
+        frame = CalendarFrame.__new__(CalendarFrame)
+        frame.sheet_types, frame.sellers = self.sheet_types, self.sellers
+        frame._days, frame._values, frame._sheet_codes = self._days[mask], self._values[mask], self._sheet_codes[mask]
+        frame._seller_codes = self._seller_codes[mask] if self._seller_codes is not None else None
+        return frame
+
+    def _keys(self, granularity, days):
+        if granularity == 'weekday':
+            return (days + 3) % 7
+        if granularity == 'iso_week':
+            return days - (days + 3) % 7
+        months = days.astype('datetime64[D]').astype('datetime64[M]')
+        mes_index = months.astype(np.int64)
+        if granularity == 'month':
+            return mes_index
+        # Semana do mês como no dashboard: (dia + weekday do dia 1 - 1) // 7
+        primeiro = months.astype('datetime64[D]').astype(np.int64)
+        dia_do_mes = days - primeiro + 1
+        return mes_index * 8 + (dia_do_mes + (primeiro + 3) % 7 - 1) // 7
+
+    def totals(self, granularity, sheet_type=None, by_seller=False):
+        """
+        (chaves, totais[, matriz vendedor x chave]) como arrays, com as chaves
+        inteiras em ordem: weekday 0-6, semana do mês (mês*8 + semana), segunda-feira
+        da semana ISO ou mês, em dias/meses desde 1970.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity inválida: {granularity}")
+        if by_seller and self._seller_codes is None:
+            raise ValueError("frame carregado sem vendedores (use by_seller=True no load)")
+        days, values, sellers = self._days, self._values, self._seller_codes
+        if sheet_type is not None:
+            mask = self._sheet_codes == (self.sheet_types.index(sheet_type) if sheet_type in self.sheet_types else -1)
+            days, values = days[mask], values[mask]
+            sellers = sellers[mask] if sellers is not None else None
+
+        keys, inverse = np.unique(self._keys(granularity, days), return_inverse=True)
+        totals = np.bincount(inverse, weights=values, minlength=len(keys))
+        if not by_seller:
+            return keys, totals
+        n_sellers = len(self.sellers)
+        flat = np.bincount(sellers * len(keys) + inverse, weights=values, minlength=n_sellers * len(keys))
+        return keys, totals, flat.reshape(n_sellers, len(keys))
+
+    def bucket(self, granularity, by_seller=False, sheet_type=None):
+        """
+        Soma os valores por bucket do calendário. Retorna
+        {"buckets": [rótulos], "totals": [...]} e, com by_seller,
+        também {"sellers": [...], "by_seller": {vendedor: [... por bucket]}}.
+        """
+        resultado = self.totals(granularity, sheet_type, by_seller)
+        keys, totals = resultado[0], resultado[1]
+        result = {"buckets": [_label(granularity, key) for key in keys.tolist()], "totals": totals.tolist()}
+        if by_seller:
+            matrix = resultado[2].tolist()
+            result["sellers"] = self.sellers
+            result["by_seller"] = {nome: matrix[i] for i, nome in enumerate(self.sellers)}
+        return result
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def _cached_frame(inicio, fim, sheet_type, by_seller, version):
+    return CalendarFrame.load(inicio, fim, sheet_type, by_seller)
+
+
+def synthetic_frame(anos=3, vendedores=30, sheet_types=('portabilidade', 'novo'), fim=None, seed=42):
+    """Frame com dados sintéticos (um valor por vendedor/dia útil/planilha), para testes e benchmark."""
+    rng = np.random.default_rng(seed)
+    fim = (fim or date.today()) - EPOCH
+    todos = np.arange(fim.days - 365 * anos, fim.days + 1, dtype=np.int64)
+    uteis = todos[(todos + 3) % 7 < 5]
+    nomes = [f"vendedor{i:03d}" for i in range(vendedores)]
+    n = len(uteis) * len(sheet_types) * vendedores
+    days = np.repeat(uteis, len(sheet_types) * vendedores)
+    sheets = np.tile(np.repeat(np.asarray(sheet_types, dtype=object), vendedores), len(uteis))
+    sellers = np.tile(np.asarray(nomes, dtype=object), len(uteis) * len(sheet_types))
+    return CalendarFrame(days, sheets, np.round(rng.uniform(0, 5000, n), 2), sellers)
@@ -0,0 +1,98 @@
+# leaderboard.py
+"""
+Agregação única das planilhas por vendedor (TVs e tabela de extração).
+
+Uma consulta com GROUP BY e somas condicionais devolve, por vendedor, o valor
+de cada dia de cada planilha pedida; os totais por vendedor e por dia saem em
+memória a partir dessas linhas.
+"""
+from datetime import timedelta
+from sqlalchemy import and_, case, func
+from models.user import User, db
+from models.sales import Sale
+from models.archive import DailySalesFact
+from routes.data import SHEET_TYPES
+
+# dia da planilha -> chave curta usada nos templates
+DIAS = [
+    ("monday", "seg"),
+    ("tuesday", "ter"),
+    ("wednesday", "qua"),
+    ("thursday", "qui"),
+    ("friday", "sex"),
+]
+CHAVES = [chave for _day, chave in DIAS]
+
+
+def _montar(rows, sheet_types):
+    """
+    Converte as linhas (user_id, username, valores...) no formato dos templates:
+    {sheet_type: {"dados": [...], "totais_diarios": {...}, "total_semana": x}}.
+    Os valores vêm na ordem sheet_types x DIAS.
+    """
+    board = {
+        sheet_type: {"dados": [], "totais_diarios": dict.fromkeys(CHAVES, 0.0), "total_semana": 0.0}
+        for sheet_type in sheet_types
+    }
+    for row in rows:
+        valores = row[2:]
+        for i, sheet_type in enumerate(sheet_types):
+            linha = {"nome": row.username}
+            for j, chave in enumerate(CHAVES):
+                linha[chave] = float(valores[i * len(CHAVES) + j] or 0)
+            linha["total"] = sum(linha[chave] for chave in CHAVES)
+
+            sheet = board[sheet_type]
+            sheet["dados"].append(linha)
+            for chave in CHAVES:
+                sheet["totais_diarios"][chave] += linha[chave]
+            sheet["total_semana"] += linha["total"]
+    return board
+
+
+def build_leaderboard(sheet_types=SHEET_TYPES):
+    """Semana atual (tabela sales) de uma ou mais planilhas, numa única consulta."""
+    colunas = [
+        func.coalesce(func.sum(case(
+            (and_(Sale.sheet_type == sheet_type, Sale.day == day), Sale.value),
+            else_=0
+        )), 0)
+        for sheet_type in sheet_types
+        for day, _chave in DIAS
+    ]
+    rows = db.session.query(User.id, User.username, *colunas)\
+        .outerjoin(Sale, and_(Sale.user_id == User.id, Sale.sheet_type.in_(sheet_types)))\
+        .filter(User.role == 'user')\
+        .group_by(User.id, User.username, User.order)\
+        .order_by(User.order.asc(), User.id.asc())\
+        .all()
+    return _montar(rows, sheet_types)
+
+
+def build_history_leaderboard(week_start, week_end, sheet_types=SHEET_TYPES):
+    """
+    Semana arquivada (tabela daily_sales_fact) no mesmo formato, com o valor de
+    cada data da semana. Há um snapshot por vendedor/dia/planilha; o MAX ignora
+    snapshots gravados sob um nome antigo do vendedor.
+    """
+    colunas = [
+        func.coalesce(func.max(case(
+            (and_(DailySalesFact.sheet_type == sheet_type, DailySalesFact.dia == week_start + timedelta(days=i)),
+             DailySalesFact.value),
+            else_=0
+        )), 0)
+        for sheet_type in sheet_types
+        for i in range(len(DIAS))
+    ]
+    rows = db.session.query(User.id, User.username, *colunas)\
+        .outerjoin(DailySalesFact, and_(
+            DailySalesFact.user_id == User.id,
+            DailySalesFact.sheet_type.in_(sheet_types),
+            DailySalesFact.dia >= week_start,
+            DailySalesFact.dia <= week_end
+        ))\
+        .filter(User.role == 'user')\
+        .group_by(User.id, User.username, User.order)\
+        .order_by(User.order.asc(), User.id.asc())\
+        .all()
+    return _montar(rows, sheet_types)
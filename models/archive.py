@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, date
+from sqlalchemy import MetaData
 from sqlalchemy.dialects.postgresql import JSON  # ✅ Use PostgreSQL JSON se estiver usando PostgreSQL
 
 from .user import db  # Usa o mesmo db inicializado em app.py
@@ -12,10 +13,16 @@ class ResumoHistory(db.Model):
     week_label = db.Column(db.String(50), nullable=False)  # Ex: "2025-09-08 a 2025-09-12"
     started_at = db.Column(db.Date, nullable=False)
     ended_at = db.Column(db.Date, nullable=False)
+    sheet_type = db.Column(db.String(20), default='portabilidade')
     total = db.Column(db.Float, nullable=False)
     breakdown = db.Column(JSON, nullable=False)  # Ex: [{"seller": "João", "total": 123.45}]
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Uma semana só pode ser fechada uma vez por planilha
+        db.UniqueConstraint('started_at', 'sheet_type', name='uq_resumo_history_week_sheet'),
+    )
+
     def __repr__(self):
         return f"<ResumoHistory {self.week_label} - Total {self.total:.2f}>"
 
@@ -25,28 +32,57 @@ class ResumoHistory(db.Model):
             "week_label": self.week_label,
             "started_at": self.started_at.isoformat(),
             "ended_at": self.ended_at.isoformat(),
+            "sheet_type": self.sheet_type,
             "total": self.total,
             "breakdown": self.breakdown,
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
 
-# Vendas diárias por vendedor
-class DailySales(db.Model):
-    __tablename__ = "daily_sales"
+# Vendas diárias por vendedor: uma linha por vendedor/dia/planilha com o valor do dia
+class DailySalesFact(db.Model):
+    __tablename__ = "daily_sales_fact"
 
     id = db.Column(db.Integer, primary_key=True)
     vendedor = db.Column(db.String(100), nullable=False)
+    # Histórico continua existindo se o vendedor for removido (vendedor guarda o nome)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), nullable=True)
     dia = db.Column(db.Date, default=date.today, nullable=False)
-    sheet_type = db.Column(db.String(20), default='portabilidade')
+    sheet_type = db.Column(db.String(20), nullable=False, default='portabilidade')
+    value = db.Column(db.Float, nullable=False, default=0.0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
-    segunda = db.Column(db.Float, default=0.0)
-    terca = db.Column(db.Float, default=0.0)
-    quarta = db.Column(db.Float, default=0.0)
-    quinta = db.Column(db.Float, default=0.0)
-    sexta = db.Column(db.Float, default=0.0)
+    __table_args__ = (
+        # Um snapshot por vendedor/dia/planilha (alvo do upsert do snapshot diário)
+        db.UniqueConstraint('vendedor', 'dia', 'sheet_type', name='uq_daily_sales_fact_vendedor_dia_sheet'),
+        db.Index('ix_daily_sales_fact_dia_sheet_user', 'dia', 'sheet_type', 'user_id'),
+        db.Index('ix_daily_sales_fact_created_id', 'created_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<DailySalesFact {self.vendedor} - {self.dia} - {self.value:.2f}>"
 
-    total = db.Column(db.Float, default=0.0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Formato antigo (uma coluna por dia da semana), somente leitura: view `daily_sales`
+# sobre daily_sales_fact criada em app.py. Fica fora de db.metadata para o
+# create_all não criar uma tabela com o nome da view.
+_view_metadata = MetaData()
+
+class DailySales(db.Model):
+    __table__ = db.Table(
+        "daily_sales", _view_metadata,
+        db.Column("id", db.Integer, primary_key=True),
+        db.Column("vendedor", db.String(100)),
+        db.Column("user_id", db.Integer),
+        db.Column("dia", db.Date),
+        db.Column("sheet_type", db.String(20)),
+        db.Column("segunda", db.Float),
+        db.Column("terca", db.Float),
+        db.Column("quarta", db.Float),
+        db.Column("quinta", db.Float),
+        db.Column("sexta", db.Float),
+        db.Column("total", db.Float),
+        db.Column("created_at", db.DateTime),
+    )
 
     def __repr__(self):
         return f"<DailySales {self.vendedor} - {self.dia} - Total {self.total:.2f}>"
@@ -55,6 +91,7 @@ class DailySales(db.Model):
         return {
             "id": self.id,
             "vendedor": self.vendedor,
+            "user_id": self.user_id,
             "dia": self.dia.isoformat(),
             "sheet_type": self.sheet_type,
             "segunda": self.segunda,
@@ -64,4 +101,17 @@ class DailySales(db.Model):
             "sexta": self.sexta,
             "total": self.total,
             "created_at": self.created_at.isoformat() if self.created_at else None,
-        }
\ No newline at end of file
+        }
+
+# Totais pré-agregados do histórico (dashboard /resumo), mantidos pelo snapshot diário
+class SalesRollup(db.Model):
+    __tablename__ = "sales_rollup"
+
+    period_type = db.Column(db.String(5), primary_key=True)   # 'day', 'week' (ISO, começa na segunda) ou 'month'
+    period_start = db.Column(db.Date, primary_key=True)
+    sheet_type = db.Column(db.String(20), primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SalesRollup {self.period_type} {self.period_start} {self.sheet_type} - {self.total:.2f}>"
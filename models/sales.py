@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from .user import db
 
 class Sale(db.Model):
@@ -8,10 +10,12 @@ class Sale(db.Model):
     day = db.Column(db.String(10), nullable=False)
     value = db.Column(db.Float, default=0.0)
     sheet_type = db.Column(db.String(20), default='portabilidade')  # Nova linha!
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True)
 
     # Atualize a UniqueConstraint para incluir sheet_type
     __table_args__ = (
         db.UniqueConstraint('employee_name', 'day', 'sheet_type', name='uq_employee_day_sheet'),
+        db.Index('ix_sales_sheet_user_day', 'sheet_type', 'user_id', 'day'),
     )
 
     def to_dict(self):
@@ -20,5 +24,48 @@ class Sale(db.Model):
             'employee_name': self.employee_name,
             'day': self.day,
             'value': self.value,
-            'sheet_type': self.sheet_type  # Nova linha!
-        }
\ No newline at end of file
+            'sheet_type': self.sheet_type,  # Nova linha!
+            'user_id': self.user_id
+        }
+
+
+class DataVersion(db.Model):
+    """Versão monotônica dos dados de cada planilha (compartilhada entre workers)."""
+    __tablename__ = 'data_version'
+
+    sheet_type = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    # Última versão em que houve mudança que não cabe no log de células
+    # (ex: vendedor incluído/removido, planilha zerada): exige recarga completa
+    resync_version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'sheet_type': self.sheet_type,
+            'version': self.version,
+            'resync_version': self.resync_version
+        }
+
+
+class SaleChange(db.Model):
+    """Log das células alteradas, usado pela sincronização incremental (delta)."""
+    __tablename__ = 'sale_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sheet_type = db.Column(db.String(20), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    employee_name = db.Column(db.String(100), nullable=False)
+    day = db.Column(db.String(10), nullable=False)
+    value = db.Column(db.Float, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_sale_changes_sheet_version', 'sheet_type', 'version'),
+    )
+
+    def to_dict(self):
+        return {
+            'employee': self.employee_name,
+            'day': self.day,
+            'value': self.value
+        }
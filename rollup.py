@@ -0,0 +1,105 @@
+# rollup.py
+"""
+Totais pré-agregados do histórico diário (tabela sales_rollup) por dia, semana ISO
+e mês, para cada planilha. O snapshot diário atualiza só os períodos da data
+gravada; rebuild_rollups() regenera tudo a partir de daily_sales_fact.
+"""
+import time
+from calendar import monthrange
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, literal, select
+from models.user import db
+from models.archive import DailySalesFact, SalesRollup
+from routes.data import dialect_insert, bump_data_version
+
+PERIOD_TYPES = ['day', 'week', 'month']
+# Linha de data_version que muda a cada alteração do histórico (chave dos caches do dashboard)
+HISTORICO_VERSION_KEY = 'historico'
+
+
+def period_bounds(period_type, dia):
+    """(início, fim) do período que contém a data."""
+    if period_type == 'day':
+        return dia, dia
+    if period_type == 'week':
+        inicio = dia - timedelta(days=dia.weekday())
+        return inicio, inicio + timedelta(days=6)
+    inicio = dia.replace(day=1)
+    return inicio, dia.replace(day=monthrange(dia.year, dia.month)[1])
+
+
+def refresh_rollups(dias, sheet_types):
+    """
+    Recalcula os períodos (dia, semana e mês) que contêm as datas informadas:
+    um INSERT ... SELECT SUM ... ON CONFLICT DO UPDATE por período, limitado às
+    linhas do próprio período. Incrementa a versão do histórico. Não faz commit.
+    """
+    periodos = {(period_type, *period_bounds(period_type, dia)) for dia in dias for period_type in PERIOD_TYPES}
+    agora = datetime.utcnow()
+    for period_type, inicio, fim in periodos:
+        soma = select(
+            literal(period_type), literal(inicio), DailySalesFact.sheet_type,
+            func.coalesce(func.sum(DailySalesFact.value), 0.0), literal(agora)
+        ).where(
+            DailySalesFact.dia >= inicio,
+            DailySalesFact.dia <= fim,
+            DailySalesFact.sheet_type.in_(sheet_types)
+        ).group_by(DailySalesFact.sheet_type)
+        stmt = dialect_insert(SalesRollup.__table__).from_select(
+            ["period_type", "period_start", "sheet_type", "total", "updated_at"], soma
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["period_type", "period_start", "sheet_type"],
+            set_={"total": stmt.excluded.total, "updated_at": stmt.excluded.updated_at}
+        )
+        db.session.execute(stmt)
+    bump_data_version(HISTORICO_VERSION_KEY)
+
+
+def rebuild_rollups():
+    """
+    Regenera sales_rollup inteira: uma consulta GROUP BY dia/planilha no fato e os
+    totais de semana e mês montados em memória. Faz commit; retorna {"rows", "elapsed_ms"}.
+    """
+    started = time.perf_counter()
+    totais = defaultdict(float)
+    try:
+        por_dia = db.session.query(DailySalesFact.dia, DailySalesFact.sheet_type, func.sum(DailySalesFact.value))\
+            .group_by(DailySalesFact.dia, DailySalesFact.sheet_type)\
+            .all()
+        for dia, sheet_type, total in por_dia:
+            for period_type in PERIOD_TYPES:
+                totais[(period_type, period_bounds(period_type, dia)[0], sheet_type)] += total or 0.0
+
+        agora = datetime.utcnow()
+        db.session.execute(delete(SalesRollup))
+        if totais:
+            db.session.execute(SalesRollup.__table__.insert(), [
+                {"period_type": period_type, "period_start": inicio, "sheet_type": sheet_type,
+                 "total": total, "updated_at": agora}
+                for (period_type, inicio, sheet_type), total in totais.items()
+            ])
+        # resync: invalida também o cache dos meses fechados
+        bump_data_version(HISTORICO_VERSION_KEY, resync=True)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {"rows": len(totais), "elapsed_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+
+def get_rollup_totals(period_type, inicio=None, fim=None, sheet_type=None):
+    """
+    {period_start: total} dos períodos que começam entre as datas, somando as
+    planilhas (ou só `sheet_type`). Faixa na chave primária: lê só sales_rollup.
+    """
+    query = db.session.query(SalesRollup.period_start, func.sum(SalesRollup.total))\
+        .filter(SalesRollup.period_type == period_type)
+    if sheet_type is not None:
+        query = query.filter(SalesRollup.sheet_type == sheet_type)
+    if inicio is not None:
+        query = query.filter(SalesRollup.period_start >= inicio)
+    if fim is not None:
+        query = query.filter(SalesRollup.period_start <= fim)
+    return {inicio_periodo: total or 0.0 for inicio_periodo, total in query.group_by(SalesRollup.period_start).all()}
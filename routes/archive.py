@@ -1,9 +1,12 @@
-from flask import Blueprint, jsonify, current_app, request, render_template
-from datetime import datetime, timedelta, date
+import json
+from flask import Blueprint, jsonify, current_app, request, render_template, Response, stream_with_context
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
 from models.user import db
 from models.archive import ResumoHistory, DailySales
-from routes.data import load_data, save_data
-from pytz import timezone  # ✅ Import necessário para timezone
+from models.sales import Sale
+from routes.data import DIAS_SEMANA, SHEET_TYPES, bump_data_version
 
 archive_bp = Blueprint('archive', __name__)
 
@@ -20,62 +23,68 @@ def format_brl(value):
 @archive_bp.route('/api/resumo-archive', methods=['POST'])
 def resumo_archive():
     """
-    Fecha a semana (Resumo):
-    - Salva totais no banco
-    - Zera a planilha
+    Fecha a semana (Resumo) numa única transação:
+    - Salva os totais por vendedor de cada planilha (agregados no SQL)
+    - Zera as planilhas com um único UPDATE
+    Idempotente por semana: repetir o fechamento não arquiva de novo nem zera a planilha.
     """
+    from leaderboard import build_leaderboard
+    from snapshot import TIMEZONE
+
     secret = current_app.config.get('RESUMO_ARCHIVE_SECRET')
     header = request.headers.get('X-SECRET-KEY')
     if secret and header != secret:
         return jsonify({"error": "unauthorized"}), 401
 
-    data = load_data()
-    spreadsheet = data.get("spreadsheetData", {})
-
-    # total por vendedor
-    per_seller = []
-    total = 0
-    for nome, valores in spreadsheet.items():
-        soma = sum([
-            valores.get("monday", 0) or 0,
-            valores.get("tuesday", 0) or 0,
-            valores.get("wednesday", 0) or 0,
-            valores.get("thursday", 0) or 0,
-            valores.get("friday", 0) or 0,
-        ])
-        total += soma
-        per_seller.append({"seller": nome, "total": soma})
-
-    # intervalo da semana (seg a sex)
-    now = datetime.utcnow()
-    start = now - timedelta(days=now.weekday())   # segunda
-    end = start + timedelta(days=4)               # sexta
-    week_label = f"{start.date()} a {end.date()}"
-
-    # salva no banco
-    history = ResumoHistory(
-        week_label=week_label,
-        started_at=start.date(),
-        ended_at=end.date(),
-        total=total,
-        breakdown=per_seller
-    )
-    db.session.add(history)
-    db.session.commit()
-
-    # zera planilha
-    for nome, valores in spreadsheet.items():
-        valores["monday"] = 0
-        valores["tuesday"] = 0
-        valores["wednesday"] = 0
-        valores["thursday"] = 0
-        valores["friday"] = 0
-    save_data(data)
+    # intervalo da semana (seg a sex), no fuso da operação
+    hoje = datetime.now(TIMEZONE).date()
+    start = hoje - timedelta(days=hoje.weekday())   # segunda
+    end = start + timedelta(days=4)                 # sexta
+    week_label = f"{start} a {end}"
+
+    try:
+        ja_fechadas = {
+            sheet_type for (sheet_type,) in
+            db.session.query(ResumoHistory.sheet_type).filter(ResumoHistory.started_at == start).all()
+        }
+        pendentes = [sheet_type for sheet_type in SHEET_TYPES if sheet_type not in ja_fechadas]
+        if not pendentes:
+            return jsonify({"status": "already_archived", "resumo": week_label})
+
+        # total por vendedor de cada planilha, numa consulta
+        board = build_leaderboard(pendentes)
+        totais = {}
+        for sheet_type in pendentes:
+            totais[sheet_type] = board[sheet_type]["total_semana"]
+            db.session.add(ResumoHistory(
+                week_label=week_label,
+                started_at=start,
+                ended_at=end,
+                sheet_type=sheet_type,
+                total=totais[sheet_type],
+                breakdown=[{"seller": linha["nome"], "total": linha["total"]} for linha in board[sheet_type]["dados"]]
+            ))
+        # Um fechamento concorrente da mesma semana esbarra no índice único aqui
+        db.session.flush()
+
+        # zera planilha
+        Sale.query.filter(Sale.sheet_type.in_(pendentes), Sale.day.in_(DIAS_SEMANA))\
+            .update({"value": 0}, synchronize_session=False)
+        bump_data_version(*pendentes, resync=True)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"status": "already_archived", "resumo": week_label})
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ERRO] resumo-archive: {e}")
+        return jsonify({"error": str(e)}), 500
 
     return jsonify({
         "status": "ok",
         "resumo": week_label,
-        "total": format_brl(total)  # ✅ formato brasileiro aplicado
+        "total": format_brl(sum(totais.values())),  # ✅ formato brasileiro aplicado
+        "totais": {sheet_type: format_brl(total) for sheet_type, total in totais.items()}
     })
 
 # ---------------------------
@@ -84,86 +93,99 @@ def resumo_archive():
 @archive_bp.route('/api/daily-save', methods=['POST'])
 def daily_save():
     """
-    Salva o estado atual da planilha no banco (DailySales).
+    Salva o estado atual da planilha no banco (daily_sales_fact).
     Salva apenas o valor do dia atual da semana para ambas as planilhas.
     """
-    from routes.data import load_data_from_db
-    
-    # Mapeamento de dias da semana (0=segunda, 4=sexta)
-    dias_semana = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-    nomes_dias = ["segunda", "terca", "quarta", "quinta", "sexta"]
-    
-    # Pega o dia da semana atual (0=segunda, 1=terça, etc.)
-    hoje = datetime.now(timezone("America/Sao_Paulo"))
-    dia_semana = hoje.weekday()  # 0=segunda, 1=terça, ..., 4=sexta
-    today = hoje.date()
-    
+    from snapshot import snapshot_daily_sales
+
+    try:
+        stats = snapshot_daily_sales()
+    except Exception as e:
+        print(f"[ERRO] daily-save: {e}")
+        return jsonify({"error": str(e)}), 500
+
     # Verifica se é fim de semana
-    if dia_semana >= 5:  # sábado=5, domingo=6
+    if stats is None:
         return jsonify({"status": "weekend", "message": "Fim de semana - não salva"}), 200
-    
-    # Pega o campo correspondente ao dia atual
-    campo_dia = dias_semana[dia_semana]
-    nome_dia = nomes_dias[dia_semana]
-    
-    print(f"[INFO] Salvando daily-save para {nome_dia} ({today})")
-    
-    total_geral = 0
-    for sheet_type in ['portabilidade', 'novo']:
-        data = load_data_from_db(sheet_type)
-        spreadsheet = data.get("spreadsheetData", {})
-        
-        for nome, valores in spreadsheet.items():
-            valor_dia = float(valores.get(campo_dia, 0) or 0)
-            total_geral += valor_dia
-            
-            # Verifica se já existe registro para este vendedor, dia e tipo de planilha
-            record = DailySales.query.filter_by(
-                vendedor=nome, 
-                dia=today, 
-                sheet_type=sheet_type
-            ).first()
-            
-            if record:
-                # Atualiza o valor do dia correspondente
-                if nome_dia == "segunda": record.segunda = valor_dia
-                elif nome_dia == "terca": record.terca = valor_dia
-                elif nome_dia == "quarta": record.quarta = valor_dia
-                elif nome_dia == "quinta": record.quinta = valor_dia
-                elif nome_dia == "sexta": record.sexta = valor_dia
-                record.total = valor_dia
-            else:
-                record = DailySales(
-                    vendedor=nome,
-                    dia=today,
-                    sheet_type=sheet_type,
-                    segunda=valor_dia if nome_dia == "segunda" else 0,
-                    terca=valor_dia if nome_dia == "terca" else 0,
-                    quarta=valor_dia if nome_dia == "quarta" else 0,
-                    quinta=valor_dia if nome_dia == "quinta" else 0,
-                    sexta=valor_dia if nome_dia == "sexta" else 0,
-                    total=valor_dia
-                )
-                db.session.add(record)
-
-    db.session.commit()
+
+    print(f"[INFO] daily-save para {stats['day']} ({stats['date']}): {stats['rows']} linhas em {stats['elapsed_ms']} ms")
     return jsonify({
         "status": "ok", 
-        "date": today.isoformat(),
-        "day": nome_dia,
-        "total": format_brl(total_geral)
+        "date": stats["date"],
+        "day": stats["day"],
+        "total": format_brl(stats["total"]),
+        "rows": stats["rows"],
+        "elapsed_ms": stats["elapsed_ms"]
     })
 
 # ---------------------------
 # Rota para consultar histórico diário em JSON
 # ---------------------------
+DAILY_HISTORY_DEFAULT_LIMIT = 100
+DAILY_HISTORY_MAX_LIMIT = 1000
+DAILY_HISTORY_STREAM_BATCH = 500
+
+def _daily_history_query(args):
+    """
+    Monta a consulta do histórico diário com os filtros da query string
+    (from/to em YYYY-MM-DD, vendedor, sheet_type e o cursor after=<created_at>,<id>),
+    do mais recente para o mais antigo. Lança ValueError se algum parâmetro for inválido.
+    """
+    query = DailySales.query
+    if args.get('from'):
+        query = query.filter(DailySales.dia >= datetime.strptime(args['from'], '%Y-%m-%d').date())
+    if args.get('to'):
+        query = query.filter(DailySales.dia <= datetime.strptime(args['to'], '%Y-%m-%d').date())
+    if args.get('vendedor'):
+        query = query.filter(DailySales.vendedor == args['vendedor'])
+    if args.get('sheet_type'):
+        query = query.filter(DailySales.sheet_type == args['sheet_type'])
+    if args.get('after'):
+        created_at_str, _, id_str = args['after'].rpartition(',')
+        created_at, last_id = datetime.fromisoformat(created_at_str), int(id_str)
+        # Keyset: continua exatamente depois da última linha da página anterior
+        query = query.filter(tuple_(DailySales.created_at, DailySales.id) < tuple_(created_at, last_id))
+    return query.order_by(DailySales.created_at.desc(), DailySales.id.desc())
+
 @archive_bp.route('/api/daily-history', methods=['GET'])
 def get_daily_history():
     """
-    Retorna o histórico diário salvo no banco
+    Retorna o histórico diário salvo no banco. Sem limit/after devolve a lista
+    completa (formato original); com eles, paginado por cursor:
+    {"items": [...], "next": "<created_at>,<id>" ou null}.
+    Com ?format=ndjson devolve um registro por linha em streaming (cursor no servidor).
     """
-    records = DailySales.query.order_by(DailySales.created_at.desc()).all()
-    return jsonify([r.to_dict() for r in records])
+    try:
+        query = _daily_history_query(request.args)
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            raise ValueError("limit deve ser positivo")
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro inválido: {e}"}), 400
+
+    if request.args.get('format') == 'ndjson':
+        if limit is not None:
+            query = query.limit(limit)
+        query = query.yield_per(DAILY_HISTORY_STREAM_BATCH)
+
+        def generate():
+            for record in query:
+                yield json.dumps(record.to_dict()) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if limit is None and not request.args.get('after'):
+        return jsonify([r.to_dict() for r in query.all()])
+
+    limit = min(limit or DAILY_HISTORY_DEFAULT_LIMIT, DAILY_HISTORY_MAX_LIMIT)
+    # Uma linha a mais só para saber se existe próxima página
+    records = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        last = records[-1]
+        next_cursor = f"{last.created_at.isoformat()},{last.id}"
+    return jsonify({"items": [r.to_dict() for r in records], "next": next_cursor})
 
 # ---------------------------
 # Página HTML com histórico (Resumo)
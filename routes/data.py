@@ -1,63 +1,300 @@
 # routes/data.py
-from flask import Blueprint, jsonify, request, session
+import math
+import threading
+from flask import Blueprint, jsonify, request, session, make_response, current_app
 from flask_cors import cross_origin
-from models.sales import Sale
+from jinja2.utils import htmlsafe_json_dumps
+from sqlalchemy import and_, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models.sales import Sale, DataVersion, SaleChange
 from models.user import User, db
+from routes.stream import notify_change
+from write_behind import CellWriteQueue
 
 data_bp = Blueprint('data', __name__)
 
-def load_data_from_db(sheet_type='portabilidade'):
-    spreadsheetData = {}
-    employees = User.query.filter_by(role='user').order_by(User.order.asc(), User.id.asc()).all()
-    for emp in employees:
-        sales = Sale.query.filter_by(employee_name=emp.username, sheet_type=sheet_type).all()
-        day_values = {sale.day: sale.value for sale in sales}
-        spreadsheetData[emp.username] = {
-            "monday": day_values.get("monday", 0),
-            "tuesday": day_values.get("tuesday", 0),
-            "wednesday": day_values.get("wednesday", 0),
-            "thursday": day_values.get("thursday", 0),
-            "friday": day_values.get("friday", 0),
-        }
+DIAS_SEMANA = ["monday", "tuesday", "wednesday", "thursday", "friday"]
+# Nome de cada dia pelo date.weekday() (0 = segunda), usado no histórico e nos relatórios
+NOMES_DIAS = ["segunda", "terca", "quarta", "quinta", "sexta", "sabado", "domingo"]
+SHEET_TYPES = ['portabilidade', 'novo']
+
+def load_sheets_from_db(sheet_types=SHEET_TYPES):
+    """
+    Carrega uma ou mais planilhas com UMA única consulta (vendedores + vendas)
+    e monta as grades em memória. Retorna {sheet_type: {"employees", "spreadsheetData"}}.
+    """
+    rows = db.session.query(User, Sale.sheet_type, Sale.day, Sale.value)\
+        .outerjoin(Sale, and_(Sale.user_id == User.id, Sale.sheet_type.in_(sheet_types)))\
+        .filter(User.role == 'user')\
+        .order_by(User.order.asc(), User.id.asc())\
+        .all()
+
+    employees = []
+    grids = {sheet_type: {} for sheet_type in sheet_types}
+    for emp, sheet_type, day, value in rows:
+        if emp.username not in grids[sheet_types[0]]:
+            employees.append(emp.to_dict())
+            for grid in grids.values():
+                grid[emp.username] = dict.fromkeys(DIAS_SEMANA, 0)
+        if sheet_type in grids and day in DIAS_SEMANA:
+            grids[sheet_type][emp.username][day] = value
+
     return {
-        "employees": [emp.to_dict() for emp in employees],
-        "spreadsheetData": spreadsheetData
+        sheet_type: {"employees": employees, "spreadsheetData": grid}
+        for sheet_type, grid in grids.items()
     }
 
+def load_data_from_db(sheet_type='portabilidade'):
+    return load_sheets_from_db([sheet_type])[sheet_type]
+
+def dialect_insert(table):
+    """INSERT específico do dialeto em uso (necessário para ON CONFLICT)."""
+    if db.engine.dialect.name == 'postgresql':
+        return pg_insert(table)
+    return sqlite_insert(table)
+
+def bulk_upsert_sales(sheet_type, cells):
+    """
+    Grava várias células de uma planilha com um único
+    INSERT ... ON CONFLICT (employee_name, day, sheet_type) DO UPDATE.
+    `cells` é um iterável de (employee_name, day, value). Não faz commit.
+    Retorna {"inserted": n, "updated": n}.
+    """
+    # Colapsa células repetidas (o ON CONFLICT não aceita a mesma chave duas vezes)
+    values = {}
+    for employee_name, day, value in cells:
+        values[(employee_name, day)] = value
+    if not values:
+        return {"inserted": 0, "updated": 0}
+
+    names = {employee_name for employee_name, _day in values}
+    existing = set(
+        db.session.query(Sale.employee_name, Sale.day)
+        .filter(Sale.sheet_type == sheet_type, Sale.employee_name.in_(names))
+        .all()
+    )
+    user_ids = dict(db.session.query(User.username, User.id).filter(User.username.in_(names)).all())
+
+    stmt = dialect_insert(Sale.__table__).values([
+        {"employee_name": employee_name, "day": day, "value": value,
+         "sheet_type": sheet_type, "user_id": user_ids.get(employee_name)}
+        for (employee_name, day), value in values.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['employee_name', 'day', 'sheet_type'],
+        set_={"value": stmt.excluded.value, "user_id": stmt.excluded.user_id}
+    )
+    db.session.execute(stmt)
+
+    updated = sum(1 for key in values if key in existing)
+    return {"inserted": len(values) - updated, "updated": updated}
+
+# === Versão dos dados + cache de snapshots por worker ===
+# Cada escrita incrementa a versão da planilha na MESMA transação, então todos os
+# workers do gunicorn enxergam a mudança; cada worker só reconstrói a grade
+# quando a versão no banco difere da versão do snapshot que tem em memória.
+_snapshot_cache = {}  # sheet_type -> (version, payload)
+_snapshot_lock = threading.Lock()
+
+# Quantas versões de cada planilha o log de células guarda para o /data/changes
+CHANGE_LOG_RETENTION = 500
+CHANGE_LOG_PRUNE_EVERY = 50
+
+def bump_data_version(*sheet_types, resync=False):
+    """
+    Incrementa a versão das planilhas indicadas (todas, se nenhuma) e retorna
+    {sheet_type: nova_versão}. Com resync=True a mudança não é descrita pelo log
+    de células (ex: lista de vendedores) e os clientes precisam recarregar a grade.
+    Não faz commit.
+    """
+    sheet_types = sheet_types or tuple(SHEET_TYPES)
+    table = DataVersion.__table__
+    stmt = dialect_insert(table).values([
+        {"sheet_type": sheet_type, "version": 1, "resync_version": 1 if resync else 0}
+        for sheet_type in sheet_types
+    ])
+    set_ = {"version": table.c.version + 1}
+    if resync:
+        set_["resync_version"] = table.c.version + 1
+    stmt = stmt.on_conflict_do_update(index_elements=['sheet_type'], set_=set_)
+    db.session.execute(stmt)
+
+    # A linha fica bloqueada até o commit, então a versão lida é a desta transação
+    versions = dict(
+        db.session.query(DataVersion.sheet_type, DataVersion.version)
+        .filter(DataVersion.sheet_type.in_(sheet_types))
+        .all()
+    )
+    if resync:
+        for sheet_type, version in versions.items():
+            notify_change(sheet_type, version, resync=True)
+    return versions
+
+def log_cell_changes(sheet_type, version, cells):
+    """
+    Registra no log as células (employee_name, day, value) alteradas nesta versão
+    e, periodicamente, descarta as entradas além da retenção. Não faz commit.
+    """
+    rows = [
+        {"sheet_type": sheet_type, "version": version,
+         "employee_name": employee_name, "day": day, "value": value}
+        for employee_name, day, value in cells
+    ]
+    if rows:
+        db.session.execute(SaleChange.__table__.insert().values(rows))
+    if version % CHANGE_LOG_PRUNE_EVERY == 0:
+        db.session.execute(
+            delete(SaleChange).where(
+                SaleChange.sheet_type == sheet_type,
+                SaleChange.version <= version - CHANGE_LOG_RETENTION
+            )
+        )
+
+def mark_cells_changed(sheet_type, cells):
+    """
+    Incrementa a versão da planilha, registra as células no log e avisa os
+    streams SSE (o aviso sai no commit). Não faz commit.
+    """
+    version = bump_data_version(sheet_type)[sheet_type]
+    log_cell_changes(sheet_type, version, cells)
+    notify_change(sheet_type, version, changes=[
+        {"employee": employee_name, "day": day, "value": value}
+        for employee_name, day, value in cells
+    ])
+    return version
+
+def get_data_versions():
+    """Retorna {sheet_type: version} com uma única consulta à chave primária."""
+    versions = dict.fromkeys(SHEET_TYPES, 0)
+    versions.update(
+        db.session.query(DataVersion.sheet_type, DataVersion.version)
+        .filter(DataVersion.sheet_type.in_(SHEET_TYPES))
+        .all()
+    )
+    return versions
+
+def get_data_version(sheet_type):
+    version = db.session.query(DataVersion.version).filter_by(sheet_type=sheet_type).scalar()
+    return version or 0
+
+def load_data_cached(sheet_type='portabilidade', version=None):
+    """
+    Igual a load_data_from_db, mas reaproveita o snapshot do worker enquanto a
+    versão no banco não mudar. O dicionário retornado é compartilhado: não modificar.
+    """
+    # A versão é lida ANTES dos dados: se uma escrita ocorrer no meio, o snapshot
+    # fica marcado com a versão antiga e é reconstruído na próxima requisição.
+    if version is None:
+        version = get_data_version(sheet_type)
+    cached = _snapshot_cache.get(sheet_type)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    payload = load_data_from_db(sheet_type)
+    with _snapshot_lock:
+        current = _snapshot_cache.get(sheet_type)
+        if not current or current[0] <= version:
+            _snapshot_cache[sheet_type] = (version, payload)
+    return payload
+
+_bootstrap_cache = {}  # "blob" -> ((versão de cada planilha), JSON)
+
+def get_bootstrap_json():
+    """
+    JSON com as duas planilhas, a lista de vendedores e as versões, pronto para ser
+    embutido no HTML da SPA. Cacheado por versão; quando muda, é refeito com UMA
+    consulta, que também atualiza os snapshots de cada planilha.
+    """
+    versions = get_data_versions()
+    key = tuple(versions[sheet_type] for sheet_type in SHEET_TYPES)
+    cached = _bootstrap_cache.get("blob")
+    if cached and cached[0] == key:
+        return cached[1]
+
+    sheets = load_sheets_from_db()
+    with _snapshot_lock:
+        for sheet_type, payload in sheets.items():
+            current = _snapshot_cache.get(sheet_type)
+            if not current or current[0] <= versions[sheet_type]:
+                _snapshot_cache[sheet_type] = (versions[sheet_type], payload)
+
+    blob = str(htmlsafe_json_dumps({
+        sheet_type: {**payload, "version": versions[sheet_type]}
+        for sheet_type, payload in sheets.items()
+    }))
+    _bootstrap_cache["blob"] = (key, blob)
+    return blob
+
+def data_etag(sheet_type, version):
+    return f"{sheet_type}-v{version}"
+
+def conditional_response(etag, build, cache_control='no-cache'):
+    """
+    304 vazio se o cliente já tem `etag` (If-None-Match), senão a resposta de
+    `build()`, que só é montada nesse caso. As duas saem com ETag e Cache-Control.
+    """
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = build()
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def parse_cell_value(value):
+    """
+    Valor numérico de uma célula vinda da grade: vazio vira 0.0 e texto aceita o
+    formato brasileiro ("1.234,56"). Lança ValueError se não for um número.
+    """
+    if value is None or value == "":
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, str):
+        raise ValueError(f"Valor inválido: {value!r}")
+    texto = value.strip()
+    if not texto:
+        return 0.0
+    if "," in texto:
+        texto = texto.replace(".", "").replace(",", ".")
+    numero = float(texto)
+    if not math.isfinite(numero):
+        raise ValueError(f"Valor inválido: {value!r}")
+    return numero
+
 def save_data_to_db(data, sheet_type='portabilidade'):
+    """
+    Salva a grade inteira de uma planilha em um número fixo de comandos.
+    Retorna (True, {"inserted", "updated"}) ou (False, mensagem de erro).
+    """
     try:
         spreadsheet_data = data.get("spreadsheetData", {})
+        cells = []
         for emp_name, days in spreadsheet_data.items():
             for day, value in days.items():
-                if day in ["monday", "tuesday", "wednesday", "thursday", "friday"]:
-                    sale = Sale.query.filter_by(
-                        employee_name=emp_name,
-                        day=day,
-                        sheet_type=sheet_type
-                    ).first()
-                    if sale:
-                        sale.value = value
-                    else:
-                        sale = Sale(
-                            employee_name=emp_name,
-                            day=day,
-                            value=value,
-                            sheet_type=sheet_type
-                        )
-                        db.session.add(sale)
+                if day not in DIAS_SEMANA:
+                    continue
+                try:
+                    cells.append((emp_name, day, parse_cell_value(value)))
+                except ValueError:
+                    return False, f"Valor inválido para {emp_name} ({day}): {value!r}"
+        stats = bulk_upsert_sales(sheet_type, cells)
+        mark_cells_changed(sheet_type, cells)
         db.session.commit()
-        return True
+        return True, stats
     except Exception as e:
         db.session.rollback()
         print(f"Erro ao salvar: {e}")
-        return False
+        return False, str(e)
 
 # 🔑 FUNÇÕES PÚBLICAS PARA COMPATIBILIDADE (ex: archive.py)
 def load_data():
     return load_data_from_db('portabilidade')
 
 def save_data(data):
-    return save_data_to_db(data, 'portabilidade')
+    success, _result = save_data_to_db(data, 'portabilidade')
+    return success
 
 # === Nova função: salvar apenas uma célula ===
 def save_cell_to_db(sheet_type, employee_name, day, value):
@@ -70,27 +307,19 @@ def save_cell_to_db(sheet_type, employee_name, day, value):
             return False, "Tipo de planilha inválido"
         if day not in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']:
             return False, "Dia da semana inválido"
-        if not isinstance(value, (int, float)):
-            value = float(value) if value else 0.0
-
-        # Busca ou cria o registro
-        sale = Sale.query.filter_by(
-            employee_name=employee_name,
-            day=day,
-            sheet_type=sheet_type
-        ).first()
-
-        if sale:
-            sale.value = value
-        else:
-            sale = Sale(
-                employee_name=employee_name,
-                day=day,
-                value=value,
-                sheet_type=sheet_type
-            )
-            db.session.add(sale)
+        value = parse_cell_value(value)
+
+        # Modo write-behind: a célula entra no próximo commit em grupo do worker
+        if current_app.config.get("CELL_WRITE_BEHIND"):
+            _success, results = get_cell_write_queue().submit([
+                {"sheet_type": sheet_type, "employee": employee_name, "day": day, "value": value}
+            ])
+            result = results[0]
+            return result["success"], "Célula salva com sucesso" if result["success"] else result["error"]
 
+        # Insere ou atualiza o registro (upsert)
+        bulk_upsert_sales(sheet_type, [(employee_name, day, value)])
+        mark_cells_changed(sheet_type, [(employee_name, day, value)])
         db.session.commit()
         return True, "Célula salva com sucesso"
     except Exception as e:
@@ -98,6 +327,91 @@ def save_cell_to_db(sheet_type, employee_name, day, value):
         print(f"Erro ao salvar célula: {e}")
         return False, str(e)
 
+# === Write-behind (opcional) para /api/cell e /api/cells ===
+_cell_write_queue = None
+_cell_write_queue_lock = threading.Lock()
+
+def get_cell_write_queue():
+    """Fila de group commit deste worker (criada na primeira escrita, após o fork)."""
+    global _cell_write_queue
+    if _cell_write_queue is None:
+        with _cell_write_queue_lock:
+            if _cell_write_queue is None:
+                app = current_app._get_current_object()
+                _cell_write_queue = CellWriteQueue(
+                    app,
+                    save_cells_to_db,
+                    max_batch=app.config.get("CELL_WRITE_BEHIND_MAX_BATCH", 100),
+                    max_delay=app.config.get("CELL_WRITE_BEHIND_MAX_DELAY_MS", 5) / 1000
+                )
+    return _cell_write_queue
+
+# === Nova função: salvar várias células de uma vez ===
+MAX_BATCH_CELLS = 500
+
+def save_cells_to_db(edits):
+    """
+    Salva um lote de edições [{sheet_type, employee, day, value}] em UMA transação.
+    Edições repetidas da mesma célula são colapsadas (vale a última); edições
+    inválidas são recusadas individualmente. Retorna (sucesso, resultados por
+    edição na ordem recebida).
+    """
+    results = [None] * len(edits)
+    latest = {}  # (sheet_type, employee, day) -> (índice, valor)
+
+    for index, edit in enumerate(edits):
+        if not isinstance(edit, dict):
+            results[index] = {"index": index, "success": False, "error": "Edição inválida"}
+            continue
+        sheet_type = edit.get('sheet_type')
+        employee = edit.get('employee')
+        day = edit.get('day')
+        value = edit.get('value', 0)
+
+        if sheet_type not in SHEET_TYPES:
+            error = "Tipo de planilha inválido"
+        elif day not in DIAS_SEMANA:
+            error = "Dia da semana inválido"
+        elif not employee:
+            error = "Dados incompletos"
+        else:
+            error = None
+            try:
+                value = parse_cell_value(value)
+            except ValueError:
+                error = "Valor inválido"
+        if error:
+            results[index] = {"index": index, "success": False, "error": error}
+            continue
+
+        key = (sheet_type, employee, day)
+        if key in latest:
+            superseded = latest[key][0]
+            results[superseded] = {"index": superseded, "success": True, "coalesced": True}
+        latest[key] = (index, value)
+
+    by_sheet = {}
+    for (sheet_type, employee, day), (index, value) in latest.items():
+        by_sheet.setdefault(sheet_type, []).append((employee, day, value))
+
+    try:
+        # Um upsert por planilha, tudo na mesma transação
+        for sheet_type, cells in by_sheet.items():
+            bulk_upsert_sales(sheet_type, cells)
+            mark_cells_changed(sheet_type, cells)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao salvar lote de células: {e}")
+        for index, result in enumerate(results):
+            if result is None or result["success"]:
+                results[index] = {"index": index, "success": False, "error": str(e)}
+        return False, results
+
+    for index, _value in latest.values():
+        results[index] = {"index": index, "success": True}
+    return True, results
+
 # === Rotas da API ===
 
 @data_bp.route('/data', methods=['GET'])
@@ -107,7 +421,51 @@ def get_data():
         sheet_type = request.args.get('type', 'portabilidade')
         if sheet_type not in ['portabilidade', 'novo']:
             sheet_type = 'portabilidade'
-        return jsonify(load_data_from_db(sheet_type)), 200
+
+        # ETag forte derivado da versão: o polling do front só baixa a grade se mudou
+        version = get_data_version(sheet_type)
+        return conditional_response(
+            data_etag(sheet_type, version),
+            lambda: jsonify({**load_data_cached(sheet_type, version), "version": version})
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@data_bp.route('/data/changes', methods=['GET'])
+@cross_origin()
+def get_data_changes():
+    """
+    Sincronização incremental: retorna só as células alteradas depois de `since`.
+    Se o log não cobre o intervalo (lista de vendedores mudou, planilha zerada ou
+    versão antiga demais), responde {"resync": true} para o cliente recarregar tudo.
+    """
+    try:
+        sheet_type = request.args.get('type', 'portabilidade')
+        if sheet_type not in ['portabilidade', 'novo']:
+            sheet_type = 'portabilidade'
+        since = request.args.get('since', type=int)
+        if since is None:
+            return jsonify({"error": "Parâmetro 'since' inválido"}), 400
+
+        current = db.session.get(DataVersion, sheet_type)
+        version = current.version if current else 0
+        resync_version = current.resync_version if current else 0
+
+        if since == version:
+            return jsonify({"version": version, "changes": []}), 200
+        if since > version or since < resync_version or since < version - CHANGE_LOG_RETENTION:
+            return jsonify({"version": version, "resync": True}), 200
+
+        changes = {}
+        log = SaleChange.query.filter(
+            SaleChange.sheet_type == sheet_type,
+            SaleChange.version > since,
+            SaleChange.version <= version
+        ).order_by(SaleChange.version.asc(), SaleChange.id.asc())
+        for change in log:
+            # Só o último valor de cada célula interessa
+            changes[(change.employee_name, change.day)] = change.to_dict()
+        return jsonify({"version": version, "changes": list(changes.values())}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -125,10 +483,11 @@ def save_data_endpoint():
         if sheet_type not in ['portabilidade', 'novo']:
             sheet_type = 'portabilidade'
 
-        if save_data_to_db(data, sheet_type):
-            return jsonify({"message": "Dados salvos"}), 200
+        success, result = save_data_to_db(data, sheet_type)
+        if success:
+            return jsonify({"message": "Dados salvos", **result}), 200
         else:
-            return jsonify({"error": "Erro ao salvar"}), 500
+            return jsonify({"error": "Erro ao salvar", "detail": result}), 500
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -157,4 +516,41 @@ def save_cell_endpoint():
 
     except Exception as e:
         print(f"Erro na rota /cell: {e}")
-        return jsonify({"error": "Erro interno do servidor"}), 500
\ No newline at end of file
+        return jsonify({"error": "Erro interno do servidor"}), 500
+
+# === Nova rota: salvar um lote de células ===
+@data_bp.route('/cells', methods=['POST'])
+@cross_origin()
+def save_cells_endpoint():
+    if 'user' not in session:
+        return jsonify({"error": "Não autenticado"}), 401
+
+    try:
+        data = request.get_json(silent=True) or {}
+        edits = data.get('edits')
+        if not isinstance(edits, list) or not edits:
+            return jsonify({"error": "Dados incompletos"}), 400
+        if len(edits) > MAX_BATCH_CELLS:
+            return jsonify({"error": f"Máximo de {MAX_BATCH_CELLS} células por lote"}), 413
+
+        if current_app.config.get("CELL_WRITE_BEHIND"):
+            # O lote inteiro entra no próximo commit em grupo do worker
+            success, results = get_cell_write_queue().submit(edits)
+        else:
+            success, results = save_cells_to_db(edits)
+        status = 200 if success else 500
+        return jsonify({"success": success, "results": results}), status
+
+    except Exception as e:
+        print(f"Erro na rota /cells: {e}")
+        return jsonify({"error": "Erro interno do servidor"}), 500
+
+@data_bp.route('/cells/stats', methods=['GET'])
+@cross_origin()
+def cell_write_stats():
+    """Contadores do write-behind deste worker (tamanho dos lotes e latência do flush)."""
+    if not session.get('is_admin'):
+        return jsonify({"error": "Acesso negado"}), 403
+    enabled = bool(current_app.config.get("CELL_WRITE_BEHIND"))
+    stats = _cell_write_queue.stats() if _cell_write_queue else {}
+    return jsonify({"enabled": enabled, **stats}), 200
\ No newline at end of file
@@ -0,0 +1,174 @@
+# routes/export.py
+"""
+Exportação do histórico diário (daily_sales_fact) em CSV ou XLSX para qualquer
+intervalo de datas, conjunto de vendedores e planilha.
+
+As linhas são lidas com cursor no servidor (yield_per) e enviadas por um
+gerador: exportar um ano inteiro não carrega o resultado na memória nem prende
+o worker renderizando uma tabela HTML.
+"""
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime, timedelta
+from functools import lru_cache
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+from sqlalchemy import Date, cast, func, select
+from models.user import db
+from models.archive import DailySalesFact
+from routes.data import NOMES_DIAS, SHEET_TYPES, conditional_response, get_data_version
+from snapshot import SEMANAS_VERSION_KEY
+
+export_bp = Blueprint('export', __name__)
+
+EXPORT_BATCH = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+CABECALHO = ["data", "dia", "planilha", "vendedor", "valor"]
+
+
+def _export_query(args):
+    """
+    SELECT das linhas do export com os filtros da query string: from/to em
+    YYYY-MM-DD, vendedor (repetido ou separado por vírgula) e sheet_type.
+    Lança ValueError se algum parâmetro for inválido.
+    """
+    stmt = select(DailySalesFact.dia, DailySalesFact.sheet_type, DailySalesFact.vendedor, DailySalesFact.value)
+    if args.get('from'):
+        stmt = stmt.where(DailySalesFact.dia >= datetime.strptime(args['from'], '%Y-%m-%d').date())
+    if args.get('to'):
+        stmt = stmt.where(DailySalesFact.dia <= datetime.strptime(args['to'], '%Y-%m-%d').date())
+    vendedores = [nome.strip() for valor in args.getlist('vendedor') for nome in valor.split(',') if nome.strip()]
+    if vendedores:
+        stmt = stmt.where(DailySalesFact.vendedor.in_(vendedores))
+    if args.get('sheet_type'):
+        if args['sheet_type'] not in SHEET_TYPES:
+            raise ValueError(f"sheet_type deve ser um de {', '.join(SHEET_TYPES)}")
+        stmt = stmt.where(DailySalesFact.sheet_type == args['sheet_type'])
+    return stmt.order_by(DailySalesFact.dia, DailySalesFact.sheet_type, DailySalesFact.vendedor)
+
+
+def _iter_rows(stmt):
+    """Linhas do export buscadas em lotes (cursor no servidor no PostgreSQL)."""
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+    for dia, sheet_type, vendedor, value in result:
+        yield [dia.isoformat(), NOMES_DIAS[dia.weekday()], sheet_type, vendedor, float(value or 0)]
+
+
+def _week_start(column):
+    """Segunda-feira da semana da data no SQL (PostgreSQL ou SQLite)."""
+    if db.engine.dialect.name == 'postgresql':
+        return cast(func.date_trunc('week', column), Date)
+    # 'weekday 0' avança até o domingo (ou fica nele); 6 dias antes é a segunda
+    return func.date(column, 'weekday 0', '-6 days', type_=Date)
+
+
+@lru_cache(maxsize=1)
+def _cached_available_weeks(versao):
+    """
+    Semanas com histórico (mais recente primeiro): [{"start", "label"}]. Um GROUP BY
+    pela segunda-feira no banco, cacheado até o snapshot gravar um dia novo.
+    """
+    semana = _week_start(DailySalesFact.dia).label('semana')
+    rows = db.session.query(semana).group_by(semana).order_by(semana.desc()).all()
+    weeks = []
+    for (monday,) in rows:
+        friday = monday + timedelta(days=4)
+        weeks.append({
+            "start": monday.isoformat(),
+            "label": f"{monday.strftime('%d/%m/%Y')} a {friday.strftime('%d/%m/%Y')}"
+        })
+    return weeks
+
+
+def _nome_arquivo(args, extensao):
+    partes = ["vendas", args.get('from') or "inicio", args.get('to') or "hoje"]
+    if args.get('sheet_type'):
+        partes.append(args['sheet_type'])
+    return "_".join(partes) + "." + extensao
+
+
+@export_bp.route('/export/sales.csv')
+def export_sales_csv():
+    """CSV do histórico diário em streaming, uma linha por vendedor/dia/planilha."""
+    try:
+        stmt = _export_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro inválido: {e}"}), 400
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CABECALHO)
+        for row in _iter_rows(stmt):
+            writer.writerow(row)
+            if buffer.tell() >= EXPORT_CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename="{_nome_arquivo(request.args, "csv")}"'
+    return response
+
+
+@export_bp.route('/export/sales.xlsx')
+def export_sales_xlsx():
+    """
+    XLSX do histórico diário. O XlsxWriter em modo constant_memory grava linha a
+    linha num arquivo temporário, que é enviado em blocos e apagado no fim.
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        return jsonify({"error": "Exportação XLSX indisponível (XlsxWriter não instalado)"}), 501
+    try:
+        stmt = _export_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Parâmetro inválido: {e}"}), 400
+
+    def generate():
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+            sheet = workbook.add_worksheet("vendas")
+            negrito = workbook.add_format({'bold': True})
+            moeda = workbook.add_format({'num_format': '#,##0.00'})
+            sheet.write_row(0, 0, CABECALHO, negrito)
+            for linha, row in enumerate(_iter_rows(stmt), start=1):
+                sheet.write_row(linha, 0, row[:4])
+                sheet.write_number(linha, 4, row[4], moeda)
+            workbook.close()
+
+            with open(path, 'rb') as arquivo:
+                while True:
+                    chunk = arquivo.read(EXPORT_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            os.remove(path)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{_nome_arquivo(request.args, "xlsx")}"'
+    return response
+
+
+@export_bp.route('/export/weeks')
+def export_weeks():
+    """Semanas disponíveis no histórico, para o seletor da tabela de extração carregar sob demanda."""
+    try:
+        versao = get_data_version(SEMANAS_VERSION_KEY)
+        return conditional_response(
+            f"semanas-v{versao}",
+            lambda: jsonify({"version": versao, "weeks": _cached_available_weeks(versao)})
+        )
+    except Exception as e:
+        db.session.rollback()
+        print(f"Erro ao carregar semanas disponíveis: {e}")
+        return jsonify({"error": "Erro ao carregar semanas"}), 500
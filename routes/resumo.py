@@ -1,41 +1,125 @@
-from flask import Blueprint, render_template, jsonify
+import threading
+from functools import lru_cache
+from flask import Blueprint, render_template, jsonify, request
 from datetime import datetime, timedelta, date
-from models.archive import DailySales
-from sqlalchemy.sql import extract
+from sqlalchemy import func
+from models.user import db
+from models.archive import SalesRollup
+from models.sales import DataVersion
+from routes.data import conditional_response, get_data_version
+from rollup import get_rollup_totals, HISTORICO_VERSION_KEY
+from snapshot import TIMEZONE
 from calendar import monthrange
-from collections import defaultdict
+import numpy as np
+from calendar_engine import CalendarFrame, GRANULARITIES
 
 resumo_bp = Blueprint("resumo", __name__)
 
-def get_daily_totals_for_month(ano, mes):
+_monthly_cache = {}  # "meses" -> (versão do histórico, {"AAAA-MM": total})
+_monthly_lock = threading.Lock()
+
+def _year_month(column):
+    """Expressão 'AAAA-MM' da data no SQL (PostgreSQL ou SQLite)."""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc('month', column), 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+def get_monthly_totals(version=None):
+    """
+    Total de cada mês do histórico ({"AAAA-MM": total}, em ordem), somando as
+    planilhas com um GROUP BY ano-mês sobre os rollups mensais. Cacheado por
+    versão do histórico; o dicionário retornado é compartilhado: não modificar.
+    """
+    if version is None:
+        version = get_data_version(HISTORICO_VERSION_KEY)
+    cached = _monthly_cache.get("meses")
+    if cached and cached[0] == version:
+        return cached[1]
+
+    ano_mes = _year_month(SalesRollup.period_start)
+    rows = db.session.query(ano_mes, func.sum(SalesRollup.total))\
+        .filter(SalesRollup.period_type == 'month')\
+        .group_by(ano_mes)\
+        .order_by(ano_mes)\
+        .all()
+    meses = {chave: total or 0.0 for chave, total in rows}
+    with _monthly_lock:
+        current = _monthly_cache.get("meses")
+        if not current or current[0] <= version:
+            _monthly_cache["meses"] = (version, meses)
+    return meses
+
+PERIODO_MAX_MESES = 120
+
+def _parse_year_month(valor):
+    """'AAAA-MM' -> date do primeiro dia do mês (ValueError se inválido)."""
+    return datetime.strptime(valor, '%Y-%m').date()
+
+def _parse_month_range(args):
+    """
+    (primeiro, último mês) de ?from=AAAA-MM&to=AAAA-MM (sem 'to', só o mês de 'from').
+    Lança ValueError com a mensagem para o cliente se o formato ou o tamanho do intervalo for inválido.
+    """
+    try:
+        inicio_mes = _parse_year_month(args.get('from', ''))
+        fim_mes = _parse_year_month(args.get('to', args.get('from', '')))
+    except ValueError:
+        raise ValueError("Parâmetros 'from' e 'to' devem estar no formato AAAA-MM") from None
+    meses = (fim_mes.year - inicio_mes.year) * 12 + fim_mes.month - inicio_mes.month + 1
+    if meses < 1 or meses > PERIODO_MAX_MESES:
+        raise ValueError(f"Intervalo deve ter de 1 a {PERIODO_MAX_MESES} meses")
+    return inicio_mes, fim_mes
+
+def get_period_totals(inicio_mes, fim_mes, granularity, sheet_type=None):
+    """
+    Totais de todos os buckets (dia útil, semana ou mês) entre o primeiro dia de
+    `inicio_mes` e o último de `fim_mes`, com uma única consulta aos rollups.
+    Buckets sem histórico vêm com total 0. Retorna [{"start": "AAAA-MM-DD", "total": x}].
+    """
+    primeiro_dia = inicio_mes
+    ultimo_dia = fim_mes.replace(day=monthrange(fim_mes.year, fim_mes.month)[1])
+    if granularity == 'week':
+        # Semanas ISO que tocam o intervalo (a primeira pode começar no mês anterior)
+        primeiro_dia -= timedelta(days=primeiro_dia.weekday())
+
+    totais = get_rollup_totals(granularity, primeiro_dia, ultimo_dia, sheet_type)
+
+    buckets = []
+    atual = primeiro_dia
+    while atual <= ultimo_dia:
+        if granularity == 'day':
+            proximo = atual + timedelta(days=1)
+            if atual.weekday() >= 5:
+                atual = proximo
+                continue
+        elif granularity == 'week':
+            proximo = atual + timedelta(days=7)
+        else:
+            proximo = (atual + timedelta(days=32)).replace(day=1)
+        buckets.append({"start": atual.isoformat(), "total": totais.get(atual, 0.0)})
+        atual = proximo
+    return buckets
+
+def _year_frame(ano):
+    """Rollups diários do ano inteiro num CalendarFrame, lido uma vez por versão do histórico."""
+    return CalendarFrame.load_cached(date(ano, 1, 1), date(ano, 12, 31))
+
+def _daily_totals_for_month(ano, mes):
     """Calcula os totais diários (soma de todas as segundas, terças, etc.) para um determinado mês e ano."""
-    
-    # 1. Obter todos os registros do mês
-    registros_mes = DailySales.query.filter(
-        extract("month", DailySales.dia) == mes,
-        extract("year", DailySales.dia) == ano
-    ).all()
-    
-    # 2. Agrupar e somar os totais de todos os vendedores por dia
-    daily_totals_map = defaultdict(float)
-    for r in registros_mes:
-        daily_totals_map[r.dia] += r.total
-        
-    # 3. Mapear os totais por dia da semana (0=Segunda, 4=Sexta)
-    # Usamos 5 posições para Segunda a Sexta
-    daily_totals = [0.0] * 5 
-    
-    for dia, total_dia in daily_totals_map.items():
-        dia_semana = dia.weekday() # 0=Segunda, 4=Sexta
-        
-        # Considerar apenas dias úteis (Segunda a Sexta)
-        if 0 <= dia_semana <= 4:
-            daily_totals[dia_semana] += total_dia
-            
-    # 4. Retornar os totais na ordem correta (Segunda a Sexta)
-    return daily_totals
+    try:
+        primeiro_dia = date(ano, mes, 1)
+        ultimo_dia = date(ano, mes, monthrange(ano, mes)[1])
+    except ValueError:
+        return [0.0] * 5
 
-def get_weekly_totals_for_month(ano, mes):
+    # Dia da semana (0=Segunda, 6=Domingo) de cada rollup diário, agrupado no calendar_engine
+    dias_semana, totais = _year_frame(ano).between(primeiro_dia, ultimo_dia).totals('weekday')
+    daily_totals = np.zeros(5)
+    uteis = dias_semana < 5
+    daily_totals[dias_semana[uteis]] = totais[uteis]
+    return daily_totals.tolist()
+
+def _weekly_totals_for_month(ano, mes):
     """Calcula os totais semanais para um determinado mês e ano."""
     try:
         primeiro_dia = date(ano, mes, 1)
@@ -43,50 +127,61 @@ def get_weekly_totals_for_month(ano, mes):
     except ValueError:
         # Lida com meses/anos inválidos
         return []
-    
-    # 1. Obter todos os registros do mês
-    registros_mes = DailySales.query.filter(
-        DailySales.dia >= primeiro_dia,
-        DailySales.dia <= ultimo_dia
-    ).all()
-    
-    # Mapeia os totais diários para fácil acesso, somando os totais de todos os vendedores para o mesmo dia
-    daily_totals_map = defaultdict(float)
-    for r in registros_mes:
-        daily_totals_map[r.dia] += r.total
-    
-    dias_no_mes = (ultimo_dia - primeiro_dia).days + 1
-    primeiro_dia_weekday = primeiro_dia.weekday() # 0=Segunda, 6=Domingo
-    
-    # Calcula o número de semanas (lógica compatível com o frontend)
-    # A semana começa na segunda-feira (weekday 0)
-    num_semanas = ((dias_no_mes + primeiro_dia_weekday) // 7)
-    if (dias_no_mes + primeiro_dia_weekday) % 7 != 0:
-         num_semanas += 1
-    
-    # Inicializa os totais semanais
-    totais_mes = [0.0] * num_semanas
-    
-    # Preenche os totais semanais
-    for dia_do_mes in range(1, dias_no_mes + 1):
-        current_date = date(ano, mes, dia_do_mes)
-        
-        # Calcula o índice da semana: (dia do mês + dia da semana do dia 1 - 1) // 7
-        semana_index = ((current_date.day + primeiro_dia_weekday - 1) // 7)
-        
-        if 0 <= semana_index < num_semanas:
-            # Adiciona o total do dia ao total da semana
-            total_do_dia = daily_totals_map.get(current_date, 0.0)
-            totais_mes[semana_index] += total_do_dia
-            
-    return totais_mes
+
+    # Número de semanas compatível com o frontend (a semana começa na segunda-feira)
+    dias_no_mes = ultimo_dia.day
+    num_semanas = -(-(dias_no_mes + primeiro_dia.weekday()) // 7)
+
+    # Chave da semana do mês: mês * 8 + índice da semana
+    chaves, totais = _year_frame(ano).between(primeiro_dia, ultimo_dia).totals('week_of_month')
+    totais_mes = np.zeros(num_semanas)
+    totais_mes[chaves % 8] = totais
+    return totais_mes.tolist()
+
+# --- Cache dos meses ---
+# Mês fechado não muda mais: fica no LRU até um rebuild dos rollups (resync_version
+# do histórico). O mês corrente é chaveado pela versão, que o snapshot incrementa.
+MONTH_CACHE_SIZE = 256
+CLOSED_MONTH_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def _month_generation(ano, mes):
+    """(mês fechado?, chave de geração do cache) para o mês."""
+    row = db.session.query(DataVersion.version, DataVersion.resync_version)\
+        .filter_by(sheet_type=HISTORICO_VERSION_KEY).first()
+    version, resync_version = row if row else (0, 0)
+    try:
+        fechado = date(ano, mes, monthrange(ano, mes)[1]) < datetime.now(TIMEZONE).date()
+    except ValueError:
+        fechado = True  # mês inválido: resultado vazio, também imutável
+    return fechado, (f"g{resync_version}" if fechado else f"v{version}")
+
+@lru_cache(maxsize=MONTH_CACHE_SIZE)
+def _cached_month_totals(kind, ano, mes, geracao):
+    calcular = _daily_totals_for_month if kind == 'dias' else _weekly_totals_for_month
+    return tuple(calcular(ano, mes))
+
+def get_daily_totals_for_month(ano, mes):
+    """Totais por dia da semana (segunda a sexta) do mês, via cache."""
+    return list(_cached_month_totals('dias', ano, mes, _month_generation(ano, mes)[1]))
+
+def get_weekly_totals_for_month(ano, mes):
+    """Totais de cada semana do mês, via cache."""
+    return list(_cached_month_totals('semanas', ano, mes, _month_generation(ano, mes)[1]))
+
+def _month_response(kind, ano, mes):
+    """Resposta JSON do mês com ETag; meses fechados podem ser cacheados para sempre."""
+    fechado, geracao = _month_generation(ano, mes)
+    return conditional_response(
+        f"{kind}-{ano}-{mes:02d}-{geracao}",
+        lambda: jsonify(list(_cached_month_totals(kind, ano, mes, geracao))),
+        CLOSED_MONTH_CACHE_CONTROL if fechado else 'no-cache'
+    )
 
 @resumo_bp.route("/api/dias/<int:ano>/<int:mes>")
 def api_dias(ano, mes):
     """Endpoint para retornar os totais diários (segunda a sexta) para um mês/ano específico."""
     try:
-        totais_diarios = get_daily_totals_for_month(ano, mes)
-        return jsonify(totais_diarios), 200
+        return _month_response('dias', ano, mes)
     except Exception as e:
         # Adicionando um log mais detalhado para depuração
         print(f"ERRO FATAL na API de dias ({ano}/{mes}): {e}")
@@ -96,13 +191,91 @@ def api_dias(ano, mes):
 def api_semanas(ano, mes):
     """Endpoint para retornar os totais semanais para um mês/ano específico."""
     try:
-        totais_semanais = get_weekly_totals_for_month(ano, mes)
-        return jsonify(totais_semanais), 200
+        return _month_response('semanas', ano, mes)
     except Exception as e:
         # Adicionando um log mais detalhado para depuração
         print(f"ERRO FATAL na API de semanas ({ano}/{mes}): {e}")
         return jsonify({"error": "Erro ao carregar dados semanais"}), 500
 
+@resumo_bp.route("/api/meses")
+def api_meses():
+    """Endpoint com o total de cada mês do histórico ({"AAAA-MM": total})."""
+    try:
+        version = get_data_version(HISTORICO_VERSION_KEY)
+        return conditional_response(f"meses-v{version}", lambda: jsonify(get_monthly_totals(version)))
+    except Exception as e:
+        print(f"ERRO FATAL na API de meses: {e}")
+        return jsonify({"error": "Erro ao carregar histórico mensal"}), 500
+
+@resumo_bp.route("/api/periodo")
+def api_periodo():
+    """
+    Endpoint com os totais de um intervalo de meses numa única chamada:
+    ?from=AAAA-MM&to=AAAA-MM&granularity=day|week|month[&sheet_type=...].
+    """
+    try:
+        inicio_mes, fim_mes = _parse_month_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({"error": "granularity deve ser day, week ou month"}), 400
+    sheet_type = request.args.get('sheet_type') or None
+
+    try:
+        version = get_data_version(HISTORICO_VERSION_KEY)
+        return conditional_response(
+            f"periodo-{inicio_mes:%Y-%m}-{fim_mes:%Y-%m}-{granularity}-{sheet_type or 'todas'}-v{version}",
+            lambda: jsonify({
+                "from": f"{inicio_mes:%Y-%m}",
+                "to": f"{fim_mes:%Y-%m}",
+                "granularity": granularity,
+                "sheet_type": sheet_type,
+                "buckets": get_period_totals(inicio_mes, fim_mes, granularity, sheet_type),
+            })
+        )
+    except Exception as e:
+        print(f"ERRO FATAL na API de período: {e}")
+        return jsonify({"error": "Erro ao carregar dados do período"}), 500
+
+@resumo_bp.route("/api/relatorio")
+def api_relatorio():
+    """
+    Relatório de vários meses/anos agrupado por calendário, via calendar_engine:
+    ?from=AAAA-MM&to=AAAA-MM&granularity=weekday|week_of_month|iso_week|month
+    [&sheet_type=...][&por_vendedor=1].
+    """
+    try:
+        inicio_mes, fim_mes = _parse_month_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    granularity = request.args.get('granularity', 'month')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity deve ser {', '.join(GRANULARITIES)}"}), 400
+    sheet_type = request.args.get('sheet_type') or None
+    por_vendedor = request.args.get('por_vendedor') in ('1', 'true')
+
+    try:
+        version = get_data_version(HISTORICO_VERSION_KEY)
+        etag = (f"relatorio-{inicio_mes:%Y-%m}-{fim_mes:%Y-%m}-{granularity}-{sheet_type or 'todas'}"
+                f"-{int(por_vendedor)}-v{version}")
+
+        def build():
+            fim = fim_mes.replace(day=monthrange(fim_mes.year, fim_mes.month)[1])
+            frame = CalendarFrame.load_cached(inicio_mes, fim, sheet_type, por_vendedor, version)
+            return jsonify({
+                "from": f"{inicio_mes:%Y-%m}",
+                "to": f"{fim_mes:%Y-%m}",
+                "granularity": granularity,
+                "sheet_type": sheet_type,
+                **frame.bucket(granularity, by_seller=por_vendedor),
+            })
+
+        return conditional_response(etag, build)
+    except Exception as e:
+        print(f"ERRO FATAL na API de relatório: {e}")
+        return jsonify({"error": "Erro ao carregar relatório"}), 500
+
 @resumo_bp.route("/resumo")
 def resumo_page():
     hoje = datetime.utcnow().date()
@@ -130,14 +303,12 @@ def resumo_page():
     mes_atual = f"{ano}-{mes:02d}"
 
     # --- Histórico mensal completo para o <select> ---
-    historico_mensal = defaultdict(float)
     try:
-        for r in DailySales.query.all():
-            chave = f"{r.dia.year}-{r.dia.month:02d}"
-            historico_mensal[chave] += r.total
+        historico_mensal = get_monthly_totals()
     except Exception as e:
+        db.session.rollback()
         print(f"Erro ao carregar histórico mensal: {e}")
-    historico_mensal = dict(sorted(historico_mensal.items()))
+        historico_mensal = {}
 
     # --- Lista de anos e meses ---
     anos_disponiveis = list(range(2025, 2031))
@@ -0,0 +1,209 @@
+# routes/stream.py
+import json
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+from flask import Blueprint, Response, request, current_app
+from sqlalchemy import event, text
+from models.sales import DataVersion
+from models.user import db
+
+stream_bp = Blueprint('stream', __name__)
+
+NOTIFY_CHANNEL = 'planilha_changes'
+PG_NOTIFY_MAX_PAYLOAD = 7000     # limite do NOTIFY é 8000 bytes
+SQLITE_POLL_INTERVAL = 2         # segundos entre leituras da versão (fallback SQLite)
+HEARTBEAT_INTERVAL = 25          # comentário SSE para manter proxies com a conexão aberta
+STREAM_MAX_SECONDS = 600         # o EventSource reconecta sozinho depois disso
+STREAM_RETRY_AFTER = 60          # segundos sugeridos ao cliente recusado por excesso de streams
+_PENDING_KEY = 'pending_change_events'
+
+
+class ChangeBroker:
+    """
+    Distribui eventos de alteração para os streams SSE abertos neste worker.
+    Um único listener por worker: LISTEN/NOTIFY no PostgreSQL ou, no SQLite,
+    leitura periódica da tabela data_version (as escritas do próprio worker
+    são publicadas direto após o commit).
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+        self._listener = None
+        self._open_streams = 0
+
+    def acquire_stream(self, limit):
+        """
+        Reserva uma vaga de stream neste worker. Cada stream prende uma thread do
+        gthread por até STREAM_MAX_SECONDS; acima do limite retorna False.
+        """
+        with self._lock:
+            if self._open_streams >= limit:
+                return False
+            self._open_streams += 1
+            return True
+
+    def release_stream(self):
+        with self._lock:
+            self._open_streams -= 1
+
+    def subscribe(self, sheet_type, app):
+        subscriber = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers[sheet_type].add(subscriber)
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, args=(app,), name='planilha-listener', daemon=True
+                )
+                self._listener.start()
+        return subscriber
+
+    def unsubscribe(self, sheet_type, subscriber):
+        with self._lock:
+            self._subscribers[sheet_type].discard(subscriber)
+
+    def publish(self, change_event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(change_event.get('sheet_type'), ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(change_event)
+            except queue.Full:
+                # Cliente lento: vai perceber o salto de versão e buscar o delta
+                pass
+
+    def _listen(self, app):
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name == 'postgresql':
+            self._listen_postgres(engine)
+        else:
+            self._poll_versions(app)
+
+    def _listen_postgres(self, engine):
+        reconnected = False
+        while True:
+            conn = None
+            try:
+                conn = engine.raw_connection()
+                pg_conn = conn.driver_connection
+                pg_conn.autocommit = True
+                pg_conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL};")
+                if reconnected:
+                    # Notificações podem ter se perdido: os clientes buscam o delta
+                    for sheet_type in list(self._subscribers):
+                        self.publish({"sheet_type": sheet_type})
+                reconnected = True
+
+                while True:
+                    if select.select([pg_conn], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                        continue
+                    pg_conn.poll()
+                    while pg_conn.notifies:
+                        notification = pg_conn.notifies.pop(0)
+                        self.publish(json.loads(notification.payload))
+            except Exception as e:
+                print(f"[SSE] Erro no LISTEN do PostgreSQL: {e}")
+                if conn is not None:
+                    conn.invalidate()
+                time.sleep(5)
+
+    def _poll_versions(self, app):
+        last_versions = None
+        while True:
+            try:
+                with app.app_context():
+                    versions = dict(db.session.query(DataVersion.sheet_type, DataVersion.version).all())
+                    db.session.remove()
+                if last_versions is not None:
+                    for sheet_type, version in versions.items():
+                        if version > last_versions.get(sheet_type, 0):
+                            self.publish({"sheet_type": sheet_type, "version": version})
+                last_versions = versions
+            except Exception as e:
+                print(f"[SSE] Erro ao consultar versões: {e}")
+            time.sleep(SQLITE_POLL_INTERVAL)
+
+
+broker = ChangeBroker()
+
+
+def notify_change(sheet_type, version, changes=None, resync=False):
+    """
+    Publica a alteração de uma planilha para os streams SSE de todos os workers.
+    Deve ser chamada dentro da transação da escrita: o evento só sai no commit.
+    """
+    change_event = {"sheet_type": sheet_type, "version": version}
+    if resync:
+        change_event["resync"] = True
+    elif changes is not None:
+        change_event["changes"] = changes
+
+    if db.engine.dialect.name == 'postgresql':
+        payload = json.dumps(change_event)
+        if len(payload) > PG_NOTIFY_MAX_PAYLOAD:
+            # Lote grande demais para o NOTIFY: os clientes buscam o delta
+            change_event.pop("changes", None)
+            payload = json.dumps(change_event)
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": NOTIFY_CHANNEL, "payload": payload}
+        )
+    else:
+        db.session.info.setdefault(_PENDING_KEY, []).append(change_event)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_pending(session):
+    for change_event in session.info.pop(_PENDING_KEY, []):
+        broker.publish(change_event)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# === Rotas ===
+
+@stream_bp.route('/stream', methods=['GET'])
+def stream_changes():
+    """Stream SSE com as alterações de uma planilha (planilha principal e TVs)."""
+    sheet_type = request.args.get('type', 'portabilidade')
+    if sheet_type not in ['portabilidade', 'novo']:
+        sheet_type = 'portabilidade'
+
+    # Sem vaga: 503 encerra o EventSource e o cliente cai no polling
+    if not broker.acquire_stream(current_app.config["SSE_MAX_STREAMS"]):
+        return Response("Limite de streams atingido", status=503, mimetype='text/plain', headers={
+            'Retry-After': str(STREAM_RETRY_AFTER),
+            'Cache-Control': 'no-store',
+        })
+
+    subscriber = broker.subscribe(sheet_type, current_app._get_current_object())
+
+    def events():
+        yield "retry: 5000\n\n"
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                change_event = subscriber.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield f"data: {json.dumps(change_event)}\n\n"
+
+    def close_stream():
+        # Roda mesmo se o cliente cair antes do primeiro evento
+        broker.unsubscribe(sheet_type, subscriber)
+        broker.release_stream()
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(close_stream)
+    return response
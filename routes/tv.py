@@ -1,93 +1,98 @@
 # routes/tv.py
 
-from flask import Blueprint, render_template
-from models.user import User
-from models.sales import Sale
-from datetime import date
+import gzip
+import json
+import threading
+from flask import Blueprint, render_template, request, Response, jsonify
+from routes.data import conditional_response, get_data_version, SHEET_TYPES
+from leaderboard import build_leaderboard, CHAVES, DIAS
 
 tv_bp = Blueprint('tv', __name__)
 
+# Agregação e respostas das TVs cacheadas por planilha e versão dos dados:
+# várias telas consultando juntas custam uma consulta/renderização por mudança.
+_board_cache = {}     # sheet_type -> (versao, board)
+_tv_cache = {}        # (formato, sheet_type) -> (versao, corpo, corpo_gzip)
+_tv_render_lock = threading.Lock()
+TV_CACHE_CONTROL = 'public, max-age=10, must-revalidate'
+# Proxies locais podem servir a resposta antiga enquanto revalidam em segundo plano
+TV_JSON_CACHE_CONTROL = 'public, max-age=5, stale-while-revalidate=30'
+
+
+def _get_board(sheet_type, versao):
+    """Agregação da planilha para a versão informada (chamar com o lock)."""
+    cached = _board_cache.get(sheet_type)
+    if not cached or cached[0] != versao:
+        cached = (versao, build_leaderboard([sheet_type])[sheet_type])
+        _board_cache[sheet_type] = cached
+    return cached[1]
+
+
+def _cached_tv_response(formato, sheet_type, render, mimetype, cache_control):
+    versao = get_data_version(sheet_type)  # lida antes dos dados (usada pelo tv.js)
+    key = (formato, sheet_type)
+    cached = _tv_cache.get(key)
+    if not cached or cached[0] != versao:
+        with _tv_render_lock:
+            cached = _tv_cache.get(key)
+            if not cached or cached[0] != versao:
+                body = render(versao, _get_board(sheet_type, versao)).encode('utf-8')
+                cached = (versao, body, gzip.compress(body, compresslevel=6))
+                _tv_cache[key] = cached
+
+    _versao, body, body_gzip = cached
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = f"tv-{formato}-{sheet_type}-v{versao}" + ("-gz" if use_gzip else "")
+
+    def build():
+        response = Response(body_gzip if use_gzip else body, mimetype=mimetype)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    response = conditional_response(etag, build, cache_control)
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _render_html(template):
+    def render(versao, board):
+        return render_template(template, dados=board["dados"], totais_diarios=board["totais_diarios"], versao=versao)
+    return render
+
+
+def _render_json(versao, board):
+    """Formato compacto: uma lista por vendedor [nome, seg..sex, total]."""
+    return json.dumps({
+        "version": versao,
+        "days": [day for day, _chave in DIAS],
+        "rows": [[linha["nome"]] + [linha[chave] for chave in CHAVES] + [linha["total"]] for linha in board["dados"]],
+        "totals": [board["totais_diarios"][chave] for chave in CHAVES],
+        "week_total": board["total_semana"],
+    }, separators=(',', ':'))
+
+
 @tv_bp.route('/tv')
 def tv_view():
     """Exibe a planilha PORTABILIDADE na TV (sem login)"""
-    employees = User.query.filter_by(role='user').order_by(User.order.asc(), User.id.asc()).all()
-    dados = []
-    totais_diarios = {"seg": 0.0, "ter": 0.0, "qua": 0.0, "qui": 0.0, "sex": 0.0}
-
-    for emp in employees:
-        sales = Sale.query.filter_by(
-            employee_name=emp.username,
-            sheet_type='portabilidade'
-        ).all()
-        day_values = {sale.day: sale.value for sale in sales}
-
-        seg = day_values.get('monday', 0)
-        ter = day_values.get('tuesday', 0)
-        qua = day_values.get('wednesday', 0)
-        qui = day_values.get('thursday', 0)
-        sex = day_values.get('friday', 0)
-        total = seg + ter + qua + qui + sex
-
-        dados.append({
-            "nome": emp.username,
-            "seg": seg,
-            "ter": ter,
-            "qua": qua,
-            "qui": qui,
-            "sex": sex,
-            "total": total
-        })
-
-        totais_diarios["seg"] += seg
-        totais_diarios["ter"] += ter
-        totais_diarios["qua"] += qua
-        totais_diarios["qui"] += qui
-        totais_diarios["sex"] += sex
-
-    return render_template('tv.html', dados=dados, totais_diarios=totais_diarios)
+    return _cached_tv_response('html', 'portabilidade', _render_html('tv.html'), 'text/html', TV_CACHE_CONTROL)
 
 
 @tv_bp.route('/tv/novo')
 def tv_novo_view():
     """Exibe a planilha NOVO na TV (sem login)"""
-    employees = User.query.filter_by(role='user').order_by(User.order.asc(), User.id.asc()).all()  # ← AQUI TAMBÉM!
-    dados = []
-    totais_diarios = {"seg": 0.0, "ter": 0.0, "qua": 0.0, "qui": 0.0, "sex": 0.0}
-
-    for emp in employees:
-        sales = Sale.query.filter_by(
-            employee_name=emp.username,
-            sheet_type='novo'
-        ).all()
-        day_values = {sale.day: sale.value for sale in sales}
-
-        seg = day_values.get('monday', 0)
-        ter = day_values.get('tuesday', 0)
-        qua = day_values.get('wednesday', 0)
-        qui = day_values.get('thursday', 0)
-        sex = day_values.get('friday', 0)
-        total = seg + ter + qua + qui + sex
-
-        dados.append({
-            "nome": emp.username,
-            "seg": seg,
-            "ter": ter,
-            "qua": qua,
-            "qui": qui,
-            "sex": sex,
-            "total": total
-        })
-
-        totais_diarios["seg"] += seg
-        totais_diarios["ter"] += ter
-        totais_diarios["qua"] += qua
-        totais_diarios["qui"] += qui
-        totais_diarios["sex"] += sex
-
-    return render_template('tv_novo.html', dados=dados, totais_diarios=totais_diarios)
+    return _cached_tv_response('html', 'novo', _render_html('tv_novo.html'), 'text/html', TV_CACHE_CONTROL)
+
+
+@tv_bp.route('/api/tv/<sheet_type>')
+def tv_board_json(sheet_type):
+    """Linhas, totais e versão da planilha para as TVs atualizarem a tabela no lugar (sem login)"""
+    if sheet_type not in SHEET_TYPES:
+        return jsonify({"error": "Planilha inválida"}), 404
+    return _cached_tv_response('json', sheet_type, _render_json, 'application/json', TV_JSON_CACHE_CONTROL)
 
 
 @tv_bp.route('/tv/clima')
 def tv_clima_view():
     """Exibe o clima na TV (sem login)"""
-    return render_template('clima.html')
\ No newline at end of file
+    return render_template('clima.html')
@@ -1,6 +1,9 @@
 from flask import Blueprint, jsonify, request, session
 from models.user import User, db
 from models.sales import Sale # Importar o modelo Sale
+from models.archive import DailySalesFact
+from sqlalchemy import or_
+from routes.data import bump_data_version
 import json
 import os
 
@@ -97,6 +100,7 @@ def create_user():
     user = User(username=username, email=email, role=role, order=max_order + 1)
     user.set_password(password)
     db.session.add(user)
+    bump_data_version(resync=True)  # a lista de vendedores faz parte das planilhas
     db.session.commit()
     return jsonify(user.to_dict()), 201
 
@@ -109,9 +113,14 @@ def get_user(user_id):
 def update_user(user_id):
     user = User.query.get_or_404(user_id)
     data = request.json
-    user.username = data.get('username', user.username)
+    new_username = data.get('username', user.username)
+    if new_username != user.username:
+        # Só a grade da semana usa o nome como chave; o histórico segue ligado pelo user_id
+        Sale.query.filter_by(user_id=user.id).update({"employee_name": new_username}, synchronize_session=False)
+    user.username = new_username
     user.email = data.get('email', user.email)
     user.role = data.get('role', user.role) # Permite atualizar a role
+    bump_data_version(resync=True)
     db.session.commit()
     return jsonify(user.to_dict())
 
@@ -119,10 +128,16 @@ def update_user(user_id):
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
     
-    # Excluir vendas associadas ao funcionário
-    Sale.query.filter_by(employee_name=user.username).delete()
-    
+    # Excluir vendas associadas ao funcionário (inclusive linhas antigas sem user_id)
+    Sale.query.filter(or_(Sale.user_id == user.id, Sale.employee_name == user.username))\
+        .delete(synchronize_session=False)
+
+    # O histórico fica, mas sem o id: o SQLite não aplica o ON DELETE SET NULL
+    # (sem PRAGMA foreign_keys) e o id pode ser reutilizado por outro vendedor
+    DailySalesFact.query.filter_by(user_id=user.id).update({"user_id": None}, synchronize_session=False)
+
     db.session.delete(user)
+    bump_data_version(resync=True)
     db.session.commit()
     return '', 204
 
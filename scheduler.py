@@ -25,63 +25,17 @@ def format_brl(value):
 def salvar_resumo_diario(app):
     with app.app_context():
         try:
-            from routes.data import load_data_from_db
-            from models.archive import DailySales
+            from snapshot import snapshot_daily_sales
 
-            dias_semana = ["monday", "tuesday", "wednesday", "thursday", "friday"]
-            nomes_dias = ["segunda", "terca", "quarta", "quinta", "sexta"]
-
-            hoje = datetime.now(timezone("America/Sao_Paulo"))
-            dia_semana = hoje.weekday()
-
-            if dia_semana >= 5:
-                print(f"[INFO] Fim de semana ({hoje.date()}) — não salva resumo diário")
+            stats = snapshot_daily_sales()
+            if stats is None:
+                print(f"[INFO] Fim de semana ({datetime.now(timezone('America/Sao_Paulo')).date()}) — não salva resumo diário")
                 return
 
-            campo_dia = dias_semana[dia_semana]
-            nome_dia = nomes_dias[dia_semana]
-
-            print(f"[INFO] Salvando resumo diário para {nome_dia} ({hoje.date()})")
-
-            today = hoje.date()
-            total_geral = 0
-
-            for sheet_type in ['portabilidade', 'novo']:
-                data = load_data_from_db(sheet_type)
-                spreadsheet = data.get("spreadsheetData", {})
-
-                for nome, valores in spreadsheet.items():
-                    valor_dia = float(valores.get(campo_dia, 0) or 0)
-                    total_geral += valor_dia
-                    
-                    # Tenta encontrar um registro existente para o vendedor, dia e tipo
-                    record = DailySales.query.filter_by(vendedor=nome, dia=today, sheet_type=sheet_type).first()
-                    
-                    if record:
-                        # Atualiza o registro existente
-                        if nome_dia == "segunda": record.segunda = valor_dia
-                        elif nome_dia == "terca": record.terca = valor_dia
-                        elif nome_dia == "quarta": record.quarta = valor_dia
-                        elif nome_dia == "quinta": record.quinta = valor_dia
-                        elif nome_dia == "sexta": record.sexta = valor_dia
-                        record.total = valor_dia
-                    else:
-                        # Cria um novo registro se não existir
-                        record = DailySales(
-                            vendedor=nome,
-                            dia=today,
-                            sheet_type=sheet_type,
-                            segunda=valor_dia if nome_dia == "segunda" else 0,
-                            terca=valor_dia if nome_dia == "terca" else 0,
-                            quarta=valor_dia if nome_dia == "quarta" else 0,
-                            quinta=valor_dia if nome_dia == "quinta" else 0,
-                            sexta=valor_dia if nome_dia == "sexta" else 0,
-                            total=valor_dia
-                        )
-                        db.session.add(record)
-
-            db.session.commit()
-            print(f"[OK] Resumo diário salvo em {hoje} — Total Geral: R$ {format_brl(total_geral)}")
+            print(
+                f"[OK] Resumo diário salvo para {stats['day']} ({stats['date']}) — "
+                f"{stats['rows']} linhas em {stats['elapsed_ms']} ms — Total Geral: R$ {format_brl(stats['total'])}"
+            )
 
         except Exception as e:
             print(f"[ERRO] salvar_resumo_diario: {e}")
@@ -93,10 +47,12 @@ def reset_planilha_semanal(app):
     with app.app_context():
         try:
             from models.sales import Sale
+            from routes.data import bump_data_version
             # Zera os valores de 'value' para todos os registros de vendas
             # para os dias da semana 'monday' a 'friday'
             Sale.query.filter(Sale.day.in_(["monday", "tuesday", "wednesday", "thursday", "friday"]))\
                       .update({"value": 0}, synchronize_session=False)
+            bump_data_version(resync=True)
 
             db.session.commit()
             print(f"[OK] Planilha semanal zerada em {datetime.now(timezone('America/Sao_Paulo'))}")
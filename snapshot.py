@@ -0,0 +1,96 @@
+# snapshot.py
+"""
+Snapshot diário das planilhas na tabela daily_sales_fact.
+
+Usado pela rota /archive/api/daily-save e pelo scheduler: o valor do dia atual
+de cada vendedor é copiado de `sales` com INSERT ... SELECT ... ON CONFLICT
+(vendedor, dia, sheet_type) DO UPDATE (uma instrução por planilha), numa única
+transação, independente do tamanho da equipe. Os totais de sales_rollup do
+dia, semana e mês são atualizados junto; a versão 'semanas' só muda quando o
+dia ainda não existia no histórico.
+"""
+import time
+from datetime import datetime
+from pytz import timezone
+from sqlalchemy import and_, func, literal, select
+from models.user import User, db
+from models.sales import Sale
+from models.archive import DailySalesFact
+from routes.data import DIAS_SEMANA, NOMES_DIAS, SHEET_TYPES, dialect_insert, bump_data_version
+from rollup import refresh_rollups
+
+TIMEZONE = timezone("America/Sao_Paulo")
+# Linha de data_version que muda quando um dia novo entra no histórico (semanas disponíveis)
+SEMANAS_VERSION_KEY = 'semanas'
+
+
+def _snapshot_select(sheet_type, day, today, created_at):
+    """SELECT com uma linha de daily_sales_fact por vendedor (0 se não houver venda no dia)."""
+    return select(
+        User.username, User.id, literal(today), literal(sheet_type),
+        func.coalesce(Sale.value, 0.0), literal(created_at)
+    ).select_from(User)\
+        .outerjoin(Sale, and_(
+            Sale.user_id == User.id,
+            Sale.sheet_type == sheet_type,
+            Sale.day == day
+        ))\
+        .where(User.role == 'user')
+
+
+def snapshot_daily_sales(now=None, sheet_types=SHEET_TYPES):
+    """
+    Grava o snapshot do dia em daily_sales_fact e faz commit.
+    Retorna None no fim de semana; senão {"date", "day", "rows", "total", "elapsed_ms"}.
+    Em caso de erro faz rollback e relança a exceção.
+    """
+    now = now or datetime.now(TIMEZONE)
+    dia_semana = now.weekday()
+    if dia_semana >= 5:
+        return None
+
+    day = DIAS_SEMANA[dia_semana]
+    nome_dia = NOMES_DIAS[dia_semana]
+    today = now.date()
+    started = time.perf_counter()
+
+    vendedores = select(User.username).where(User.role == 'user')
+    do_dia = and_(
+        DailySalesFact.dia == today,
+        DailySalesFact.sheet_type.in_(sheet_types),
+        DailySalesFact.vendedor.in_(vendedores)
+    )
+    colunas = ["vendedor", "user_id", "dia", "sheet_type", "value", "created_at"]
+
+    try:
+        dia_novo = not db.session.query(
+            select(DailySalesFact.id).where(DailySalesFact.dia == today).exists()
+        ).scalar()
+        rows = 0
+        for sheet_type in sheet_types:
+            stmt = dialect_insert(DailySalesFact.__table__).from_select(
+                colunas, _snapshot_select(sheet_type, day, today, datetime.utcnow())
+            )
+            # Salvo de novo no mesmo dia: atualiza o valor
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["vendedor", "dia", "sheet_type"],
+                set_={"value": stmt.excluded.value, "user_id": stmt.excluded.user_id}
+            )
+            rows += db.session.execute(stmt).rowcount
+        # Totais do dashboard (dia, semana e mês de hoje) na mesma transação
+        refresh_rollups([today], sheet_types)
+        if dia_novo:
+            bump_data_version(SEMANAS_VERSION_KEY)
+        total = db.session.query(func.coalesce(func.sum(DailySalesFact.value), 0.0)).filter(do_dia).scalar()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        "date": today.isoformat(),
+        "day": nome_dia,
+        "rows": rows,
+        "total": float(total),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -5,6 +5,9 @@ let employees = [];
 let spreadsheetDataPortabilidade = {};
 let spreadsheetDataNovo = {};
 let currentSheet = null; // 'portabilidade' ou 'novo'
+let sheetEtags = {}; // último ETag recebido de /api/data por planilha
+let sheetVersions = {}; // versão dos dados já aplicada por planilha
+let liveSource = null; // EventSource de /api/stream da planilha aberta
 
 // Inicialização
 document.addEventListener('DOMContentLoaded', function () {
@@ -12,12 +15,35 @@ document.addEventListener('DOMContentLoaded', function () {
     setupEventListeners();
 });
 
+// Dados iniciais embutidos no HTML pelo servidor (usados só no primeiro carregamento)
+function takeBootstrapData() {
+    const element = document.getElementById('bootstrap-data');
+    if (!element) return null;
+    element.remove();
+    try {
+        return JSON.parse(element.textContent);
+    } catch (error) {
+        console.warn('Dados iniciais inválidos:', error);
+        return null;
+    }
+}
+
 async function initializeApp() {
+    const bootstrap = takeBootstrapData();
+
     try {
-        const [dataPort, dataNovo] = await Promise.all([
-            fetch('/api/data?type=portabilidade', { credentials: 'include' }).then(r => r.json()),
-            fetch('/api/data?type=novo', { credentials: 'include' }).then(r => r.json())
-        ]);
+        let dataPort, dataNovo;
+        if (bootstrap) {
+            dataPort = bootstrap.data.portabilidade;
+            dataNovo = bootstrap.data.novo;
+            sheetVersions.portabilidade = dataPort.version;
+            sheetVersions.novo = dataNovo.version;
+        } else {
+            [dataPort, dataNovo] = await Promise.all([
+                fetchSheetData('portabilidade'),
+                fetchSheetData('novo')
+            ]);
+        }
 
         employees = dataPort.employees || dataNovo.employees || [];
 
@@ -41,15 +67,16 @@ async function initializeApp() {
     }
 
     try {
-        const sessionResponse = await fetch('/api/check-session', { credentials: 'include' });
-        if (sessionResponse.ok) {
-            const sessionData = await sessionResponse.json();
-            if (sessionData.logged_in) {
-                currentUser = sessionData.user;
-                isAdmin = sessionData.is_admin;
-                showSheet('portabilidade');
-                return;
-            }
+        let sessionData = bootstrap ? bootstrap.session : null;
+        if (!sessionData) {
+            const sessionResponse = await fetch('/api/check-session', { credentials: 'include' });
+            sessionData = sessionResponse.ok ? await sessionResponse.json() : {};
+        }
+        if (sessionData.logged_in) {
+            currentUser = sessionData.user;
+            isAdmin = sessionData.is_admin;
+            showSheet('portabilidade');
+            return;
         }
     } catch (error) {
         console.error('Erro ao verificar sessão:', error);
@@ -62,35 +89,152 @@ function getCurrentSpreadsheetData() {
     return currentSheet === 'novo' ? spreadsheetDataNovo : spreadsheetDataPortabilidade;
 }
 
+// Busca a grade completa e guarda o ETag para as próximas consultas
+async function fetchSheetData(sheetType) {
+    const response = await fetch(`/api/data?type=${sheetType}`, {
+        credentials: 'include',
+        cache: 'no-store'
+    });
+    sheetEtags[sheetType] = response.headers.get('ETag');
+    const data = await response.json();
+    sheetVersions[sheetType] = data.version;
+    return data;
+}
+
 // 🔁 Atualiza dados do servidor periodicamente
 async function pollServerData() {
     if (!currentUser || !currentSheet) return;
+    const sheetType = currentSheet;
 
     try {
-        const response = await fetch(`/api/data?type=${currentSheet}`, {
-            credentials: 'include'
+        // Com a versão conhecida, pede só as células alteradas desde ela
+        if (sheetVersions[sheetType] !== undefined) {
+            const response = await fetch(`/api/data/changes?type=${sheetType}&since=${sheetVersions[sheetType]}`, {
+                credentials: 'include',
+                cache: 'no-store'
+            });
+            if (response.ok) {
+                const delta = await response.json();
+                if (!delta.resync && applyCellChanges(sheetType, delta.changes)) {
+                    sheetVersions[sheetType] = delta.version;
+                    return;
+                }
+            }
+        }
+        await refreshSheet(sheetType);
+    } catch (error) {
+        console.warn('Falha ao atualizar dados em segundo plano:', error);
+    }
+}
+
+// Aplica células alteradas sem reconstruir a tabela; false se exigir recarga completa
+function applyCellChanges(sheetType, changes) {
+    const data = sheetType === 'novo' ? spreadsheetDataNovo : spreadsheetDataPortabilidade;
+    if (changes.some(change => !data[change.employee])) return false;
+
+    changes.forEach(change => {
+        data[change.employee][change.day] = change.value;
+        const cell = document.querySelector(
+            `td[data-sheet="${CSS.escape(sheetType)}"][data-employee="${CSS.escape(change.employee)}"][data-day="${CSS.escape(change.day)}"]`
+        );
+        // Não sobrescreve uma célula que está sendo editada
+        if (cell && !cell.querySelector('input')) {
+            cell.textContent = formatCurrency(change.value);
+        }
+    });
+    if (changes.length) updateTotals(sheetType);
+    return true;
+}
+
+// Recarrega a grade completa (GET condicional com o último ETag)
+async function refreshSheet(sheetType) {
+    try {
+        // Envia o último ETag: se nada mudou o servidor responde 304 sem corpo
+        const headers = {};
+        if (sheetEtags[sheetType]) {
+            headers['If-None-Match'] = sheetEtags[sheetType];
+        }
+        const response = await fetch(`/api/data?type=${sheetType}`, {
+            credentials: 'include',
+            cache: 'no-store',
+            headers
         });
 
+        if (response.status === 304) return;
+
         if (response.ok) {
             const newData = await response.json();
+            sheetEtags[sheetType] = response.headers.get('ETag');
+            sheetVersions[sheetType] = newData.version;
+            employees = newData.employees || employees;
 
-            if (currentSheet === 'novo') {
+            if (sheetType === 'novo') {
                 spreadsheetDataNovo = newData.spreadsheetData || {};
             } else {
                 spreadsheetDataPortabilidade = newData.spreadsheetData || {};
             }
 
-            if (currentSheet === 'novo') {
+            if (currentSheet !== sheetType) return;
+            if (sheetType === 'novo') {
                 renderSpreadsheetNovo();
             } else {
                 renderSpreadsheet();
             }
         }
     } catch (error) {
-        console.warn('Falha ao atualizar dados em segundo plano:', error);
+        console.warn('Falha ao recarregar a planilha:', error);
+    }
+}
+
+// 📡 Atualizações em tempo real via SSE; o polling só roda enquanto o stream estiver caído
+function startLiveUpdates(sheetType) {
+    stopLiveUpdates();
+    if (!window.EventSource) {
+        startAutoRefresh();
+        return;
+    }
+
+    liveSource = new EventSource(`/api/stream?type=${sheetType}`, { withCredentials: true });
+    liveSource.onopen = () => {
+        stopAutoRefresh();
+        pollServerData(); // recupera o que mudou enquanto estava desconectado
+    };
+    const source = liveSource;
+    liveSource.onerror = () => {
+        if (!window.autoRefreshInterval) startAutoRefresh();
+        // Servidor sem vaga de stream (503): o EventSource desiste; tenta de novo mais tarde
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(() => {
+                if (liveSource === source && currentSheet === sheetType) startLiveUpdates(sheetType);
+            }, 60000);
+        }
+    };
+    liveSource.onmessage = (e) => {
+        if (currentSheet !== sheetType) return;
+        handleLiveEvent(sheetType, JSON.parse(e.data));
+    };
+}
+
+function stopLiveUpdates() {
+    if (liveSource) {
+        liveSource.close();
+        liveSource = null;
     }
 }
 
+function handleLiveEvent(sheetType, event) {
+    const known = sheetVersions[sheetType];
+    if (event.version !== undefined && known !== undefined && event.version <= known) return;
+
+    // Só aplica direto se for exatamente a próxima versão; senão busca o delta
+    if (event.changes && known !== undefined && event.version === known + 1
+        && applyCellChanges(sheetType, event.changes)) {
+        sheetVersions[sheetType] = event.version;
+        return;
+    }
+    pollServerData();
+}
+
 function startAutoRefresh() {
     if (window.autoRefreshInterval) {
         clearInterval(window.autoRefreshInterval);
@@ -105,27 +249,56 @@ function stopAutoRefresh() {
     }
 }
 
-// ✅ Salvar APENAS uma célula
-async function saveCellToServer(sheetType, employee, day, value) {
+// ✅ Edições de células são agrupadas e enviadas em lote para /api/cells
+const CELL_SAVE_DEBOUNCE_MS = 300;
+let pendingCellEdits = new Map(); // "sheet|employee|day" -> edição (vale a última)
+let cellSaveTimer = null;
+
+function queueCellSave(sheetType, employee, day, value) {
+    pendingCellEdits.set(`${sheetType}|${employee}|${day}`, { sheet_type: sheetType, employee, day, value });
+    clearTimeout(cellSaveTimer);
+    cellSaveTimer = setTimeout(flushCellSaves, CELL_SAVE_DEBOUNCE_MS);
+}
+
+function takePendingCellEdits() {
+    clearTimeout(cellSaveTimer);
+    cellSaveTimer = null;
+    const edits = Array.from(pendingCellEdits.values());
+    pendingCellEdits = new Map();
+    return edits;
+}
+
+async function flushCellSaves() {
+    const edits = takePendingCellEdits();
+    if (!edits.length) return true;
     try {
-        const response = await fetch('/api/cell', {
+        const response = await fetch('/api/cells', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ sheet_type: sheetType, employee, day, value }),
+            body: JSON.stringify({ edits }),
             credentials: 'include'
         });
-
-        if (!response.ok) {
-            throw new Error('Falha ao salvar célula');
+        const data = await response.json();
+        const failed = (data.results || []).filter(result => !result.success);
+        if (!response.ok || failed.length) {
+            throw new Error(failed.length ? failed[0].error : 'Falha ao salvar células');
         }
         return true;
     } catch (error) {
-        console.error('Erro ao salvar célula:', error);
+        console.error('Erro ao salvar células:', error);
         showMessage('Erro ao salvar valor!', 'error');
         return false;
     }
 }
 
+// Não perde edições pendentes ao fechar a aba
+window.addEventListener('pagehide', () => {
+    const edits = takePendingCellEdits();
+    if (edits.length && navigator.sendBeacon) {
+        navigator.sendBeacon('/api/cells', new Blob([JSON.stringify({ edits })], { type: 'application/json' }));
+    }
+});
+
 function setupEventListeners() {
     document.getElementById('login-form').addEventListener('submit', handleLogin);
     document.getElementById('btn-portabilidade')?.addEventListener('click', () => showSheet('portabilidade'));
@@ -181,6 +354,8 @@ async function handleLogin(e) {
 
 async function handleLogout() {
     stopAutoRefresh(); // ← Importante!
+    stopLiveUpdates();
+    await flushCellSaves();
     try {
         await fetch('/api/logout', { method: 'POST', credentials: 'include' });
     } catch (error) {
@@ -223,7 +398,7 @@ function showSheet(sheetType) {
         renderSpreadsheet();
     }
 
-    startAutoRefresh(); // ← Inicia atualização automática
+    startLiveUpdates(sheetType); // ← Inicia atualização automática
 }
 
 function renderSpreadsheet() {
@@ -334,8 +509,8 @@ async function finishEditing(cell, input, sheetType) {
 
     updateTotals(sheetType);
 
-    // ✅ Salva APENAS essa célula
-    await saveCellToServer(sheetType, employee, day, newValue);
+    // ✅ Agenda o salvamento dessa célula (enviada em lote)
+    queueCellSave(sheetType, employee, day, newValue);
 }
 
 function calculateWeeklyTotal(employeeName, sheetType) {
@@ -367,8 +542,8 @@ function updateTotals(sheetType) {
     employees.forEach(employee => {
         const weeklyTotal = calculateWeeklyTotal(employee.username, sheetType);
         const selector = sheetType === 'novo'
-            ? `[data-employee="${employee.username}"][data-sheet="novo"]`
-            : `[data-employee="${employee.username}"]`;
+            ? `[data-employee="${CSS.escape(employee.username)}"][data-sheet="novo"]`
+            : `[data-employee="${CSS.escape(employee.username)}"]`;
         const row = document.querySelector(selector)?.parentElement;
         if (row) {
             const totalCell = row.querySelector('.total-cell');
@@ -0,0 +1,161 @@
+// Atualização em tempo real das telas de TV (/tv e /tv/novo) via SSE.
+// As células são atualizadas no lugar; mudanças que não cabem num patch redesenham a tabela
+// a partir de /api/tv/<planilha>, sem recarregar a página.
+(function () {
+    const table = document.querySelector('table[data-sheet]');
+    if (!table) return;
+    const sheetType = table.dataset.sheet;
+    const DAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday'];
+    let version = parseInt(table.dataset.version, 10);
+
+    function formatBRL(value) {
+        return 'R$ ' + Number(value || 0).toLocaleString('pt-BR', {
+            minimumFractionDigits: 2,
+            maximumFractionDigits: 2
+        });
+    }
+
+    function setValue(cell, value) {
+        cell.dataset.value = value;
+        cell.textContent = formatBRL(value);
+    }
+
+    function recomputeTotals() {
+        let weekTotal = 0;
+        DAYS.forEach(day => {
+            let dayTotal = 0;
+            table.querySelectorAll(`tr[data-employee] td[data-day="${day}"]`).forEach(cell => {
+                dayTotal += parseFloat(cell.dataset.value) || 0;
+            });
+            const totalCell = table.querySelector(`td[data-total-day="${day}"]`);
+            if (totalCell) setValue(totalCell, dayTotal);
+            weekTotal += dayTotal;
+        });
+        table.querySelectorAll('tr[data-employee]').forEach(row => {
+            let rowTotal = 0;
+            row.querySelectorAll('td[data-day]').forEach(cell => {
+                rowTotal += parseFloat(cell.dataset.value) || 0;
+            });
+            const totalCell = row.querySelector('td[data-row-total]');
+            if (totalCell) setValue(totalCell, rowTotal);
+        });
+        const weekCell = table.querySelector('td[data-total-week]');
+        if (weekCell) setValue(weekCell, weekTotal);
+    }
+
+    function applyChanges(changes) {
+        for (const change of changes) {
+            const row = Array.from(table.querySelectorAll('tr[data-employee]'))
+                .find(tr => tr.dataset.employee === change.employee);
+            const cell = row && row.querySelector(`td[data-day="${CSS.escape(change.day)}"]`);
+            if (!cell) return false;
+            setValue(cell, change.value);
+        }
+        recomputeTotals();
+        return true;
+    }
+
+    function buildRow(row) {
+        const tr = document.createElement('tr');
+        tr.dataset.employee = row[0];
+        const nameCell = document.createElement('td');
+        nameCell.className = 'employee-name';
+        nameCell.textContent = row[0];
+        tr.appendChild(nameCell);
+        DAYS.forEach((day, i) => {
+            const cell = document.createElement('td');
+            cell.dataset.day = day;
+            setValue(cell, row[i + 1]);
+            tr.appendChild(cell);
+        });
+        const totalCell = document.createElement('td');
+        totalCell.className = 'total-cell';
+        totalCell.dataset.rowTotal = '';
+        setValue(totalCell, row[DAYS.length + 1]);
+        tr.appendChild(totalCell);
+        return tr;
+    }
+
+    // Redesenha as linhas a partir de /api/tv (vendedores novos, removidos ou planilha zerada)
+    function renderBoard(board) {
+        const totalsRow = table.querySelector('tr.daily-totals');
+        table.querySelectorAll('tr[data-employee]').forEach(tr => tr.remove());
+        board.rows.forEach(row => totalsRow.parentNode.insertBefore(buildRow(row), totalsRow));
+        recomputeTotals();
+        version = board.version;
+    }
+
+    async function refreshBoard() {
+        try {
+            const response = await fetch(`/api/tv/${sheetType}`);
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            const board = await response.json();
+            if (board.version !== version) renderBoard(board);
+        } catch (error) {
+            console.warn('Falha ao atualizar a TV:', error);
+        }
+    }
+
+    // Busca o que mudou desde a versão exibida; redesenha a tabela se o delta não bastar
+    async function catchUp() {
+        try {
+            const response = await fetch(`/api/data/changes?type=${sheetType}&since=${version}`, { cache: 'no-store' });
+            const delta = await response.json();
+            if (response.ok && !delta.resync && applyChanges(delta.changes)) {
+                version = delta.version;
+                return;
+            }
+        } catch (error) {
+            console.warn('Falha ao sincronizar a TV:', error);
+        }
+        refreshBoard();
+    }
+
+    function handleEvent(event) {
+        if (event.version !== undefined && event.version <= version) return;
+        if (event.changes && event.version === version + 1 && applyChanges(event.changes)) {
+            version = event.version;
+            return;
+        }
+        // Salto de versão, vendedor novo ou planilha zerada
+        catchUp();
+    }
+
+    // Sem SSE (navegador antigo ou conexão caída) a TV consulta o JSON compacto
+    const POLL_INTERVAL = 30000;
+    let pollTimer = null;
+    function startPolling() {
+        if (!pollTimer) pollTimer = setInterval(refreshBoard, POLL_INTERVAL);
+    }
+    function stopPolling() {
+        clearInterval(pollTimer);
+        pollTimer = null;
+    }
+
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    // Servidor sem vaga de stream (503): o EventSource desiste; tenta de novo mais tarde
+    const STREAM_RETRY_INTERVAL = 60000;
+    let disconnected = false;
+    function connect() {
+        const source = new EventSource(`/api/stream?type=${sheetType}`);
+        source.onmessage = (e) => handleEvent(JSON.parse(e.data));
+        source.onerror = () => {
+            disconnected = true;
+            startPolling();
+            if (source.readyState === EventSource.CLOSED) setTimeout(connect, STREAM_RETRY_INTERVAL);
+        };
+        source.onopen = () => {
+            // Eventos podem ter sido perdidos enquanto a conexão estava caída
+            if (disconnected) {
+                disconnected = false;
+                stopPolling();
+                catchUp();
+            }
+        };
+    }
+    connect();
+})();
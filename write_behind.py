@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+
+
+class _PendingEdits:
+    __slots__ = ("edits", "done", "claimed", "cancelled", "success", "results")
+
+    def __init__(self, edits):
+        self.edits = edits
+        self.done = threading.Event()
+        self.claimed = False
+        self.cancelled = False
+        self.success = False
+        self.results = []
+
+
+def _failed(edits, error):
+    return [{"index": index, "success": False, "error": error} for index in range(len(edits))]
+
+
+class CellWriteQueue:
+    """
+    Write-behind com group commit para as células da planilha (um por worker).
+
+    As requisições enfileiram suas edições e esperam; uma thread de fundo junta o
+    que chegou em até `max_delay` segundos (ou `max_batch` edições) e grava tudo
+    numa única transação via `apply_batch(edits) -> (sucesso, resultados por edição)`.
+    Cada requisição só é respondida depois que o lote dela foi commitado.
+    """
+
+    def __init__(self, app, apply_batch, max_batch=100, max_delay=0.005):
+        self.app = app
+        self.apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._claim_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "edits": 0,
+            "errors": 0,
+            "cancelled": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="cell-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, edits, timeout=10):
+        """
+        Enfileira as edições [{sheet_type, employee, day, value}] de uma requisição
+        e bloqueia até o lote delas ser gravado. Retorna (sucesso, resultados por
+        edição), no mesmo formato de `apply_batch`.
+        """
+        pending = _PendingEdits(list(edits))
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            with self._claim_lock:
+                if not pending.claimed:
+                    # Ainda na fila: sai do próximo lote, senão seria gravada depois do erro
+                    pending.cancelled = True
+                    return False, _failed(pending.edits, "Tempo esgotado aguardando a gravação das células")
+            # O lote já está no banco; a resposta tem que refletir o que foi gravado
+            pending.done.wait()
+        return pending.success, pending.results
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = stats["batches"] or 1
+        stats["avg_batch_size"] = round(stats["edits"] / batches, 2)
+        stats["avg_flush_ms"] = round(stats.pop("total_flush_ms") / batches, 3)
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].edits)
+            deadline = time.monotonic() + self.max_delay
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                size += len(batch[-1].edits)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        with self._claim_lock:
+            cancelled = [pending for pending in batch if pending.cancelled]
+            batch = [pending for pending in batch if not pending.cancelled]
+            for pending in batch:
+                pending.claimed = True
+        if cancelled:
+            with self._stats_lock:
+                self._stats["cancelled"] += len(cancelled)
+        if not batch:
+            return
+
+        edits = [edit for pending in batch for edit in pending.edits]
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                success, results = self.apply_batch(edits)
+            offset = 0
+            for pending in batch:
+                pending.success = success
+                pending.results = results[offset:offset + len(pending.edits)]
+                # Índices relativos à requisição, não ao lote combinado
+                for index, result in enumerate(pending.results):
+                    result["index"] = index
+                offset += len(pending.edits)
+        except Exception as e:
+            print(f"[ERRO] write-behind: {e}")
+            for pending in batch:
+                pending.success, pending.results = False, _failed(pending.edits, str(e))
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._stats_lock:
+                self._stats["batches"] += 1
+                self._stats["edits"] += len(edits)
+                self._stats["errors"] += sum(
+                    1 for pending in batch for result in pending.results if not result["success"]
+                )
+                self._stats["last_batch_size"] = len(edits)
+                self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(edits))
+                self._stats["last_flush_ms"] = round(elapsed_ms, 3)
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], round(elapsed_ms, 3))
+                self._stats["total_flush_ms"] += elapsed_ms
+            for pending in batch:
+                pending.done.set()